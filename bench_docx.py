@@ -0,0 +1,55 @@
+"""
+Сравнение скорости извлечения текста из DOCX: python-docx против потокового разбора lxml.
+
+Запуск: python bench_docx.py [файл.docx ...]
+Без аргументов создаётся синтетическая спецификация с абзацами и таблицами.
+"""
+import os
+import sys
+import tempfile
+import time
+
+from docx import Document
+
+from main import extract_text_from_docx_xml
+
+
+def build_sample_docx(path, paragraphs=20000, table_rows=2000):
+    doc = Document()
+    doc.sections[0].header.paragraphs[0].text = "Спецификация"
+    for i in range(paragraphs):
+        doc.add_paragraph(f"Пункт {i}: требования к оборудованию и материалам")
+    table = doc.add_table(rows=table_rows, cols=3)
+    for i, row in enumerate(table.rows):
+        row.cells[0].text = str(i)
+        row.cells[1].text = f"Позиция {i}"
+    doc.save(path)
+
+
+def python_docx_text(path):
+    return "\n".join(paragraph.text for paragraph in Document(path).paragraphs)
+
+
+def measure(func, path, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        text = func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, len(text)
+
+
+def main(paths):
+    if not paths:
+        paths = [os.path.join(tempfile.mkdtemp(), "sample.docx")]
+        build_sample_docx(paths[0])
+    for path in paths:
+        old_time, old_len = measure(python_docx_text, path)
+        new_time, new_len = measure(extract_text_from_docx_xml, path)
+        print(f"{os.path.basename(path)}: python-docx {old_time:.3f} c ({old_len} симв.), "
+              f"lxml {new_time:.3f} c ({new_len} симв.), ускорение x{old_time / new_time:.1f}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,58 +1,290 @@
 import zipfile
 import re
 from difflib import ndiff
-import PyPDF2
-import docx
 import rarfile
 import py7zr
 import pytesseract
 import fitz  # PyMuPDF
 import pandas as pd
-from PyPDF2 import PdfReader
 from docx import Document
+from lxml import etree
+from charset_normalizer import from_bytes
 from openpyxl import load_workbook
-from PIL import Image, ImageDraw
+from PIL import Image, ImageDraw, ImageTk, PngImagePlugin
 import os
 import logging
 import tkinter as tk
 from tkinter import filedialog, messagebox, simpledialog
 import shutil
+import codecs
+import errno
+import hashlib
+import itertools
+import json
+import mmap
+import multiprocessing
+import queue
+import socket
+import sys
+import threading
+import time
+import psutil
+try:
+    import resource  # жёсткий лимит памяти подпроцессов, есть только в Unix
+except ImportError:
+    resource = None
 
 output_directory_text_images = ""
 output_directory_numbering = ""
+# Пространства имён WordprocessingML для потокового разбора DOCX
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+# Обозначение документа: код из заглавных букв и цифр с разделителями (AKU.1094.0.0.RK.DC0422,
+# RDKR-IC-B-2024-0056) или буквенный префикс с длинным номером (CEV0142513)
+DESIGNATION_PATTERN = re.compile(
+    r"(?<![A-Za-zА-Яа-яЁё0-9])"
+    r"([A-ZА-ЯЁ]{2,}[A-ZА-ЯЁ0-9]*(?:[.\-][A-ZА-ЯЁ0-9]+){2,}|[A-ZА-ЯЁ]{2,}\d{6,})"
+    r"(?![A-Za-zА-Яа-яЁё0-9])"
+)
+# Сколько символов начала текста просматривается при поиске обозначения
+designation_search_chars = 2000
+# Сколько памяти (МБ) занимает текст документов, хранимый между этапами одного запуска
+document_text_cache_mb = 256
+# Размер начального фрагмента .txt, по которому определяется кодировка
+txt_encoding_sample_size = 64 * 1024
+# Кодировки, которым отдаётся предпочтение, если они декодируют фрагмент не хуже найденной
+txt_preferred_encodings = ["cp1251", "cp866", "koi8_r"]
+# Через сколько секунд без продления аренды задача распределённой очереди возвращается в работу
+queue_lease_timeout = 300
+# Как часто (с) журнал запуска сбрасывается на диск с fsync; шаги, которые нельзя повторять, записываются сразу
+journal_sync_interval = 5
+# Количество рабочих потоков на этапах описи со справочником (разбор документов каждый поток ведёт
+# в своём подпроцессе) и ёмкость очередей между этапами
+pipeline_stage_workers = {'extraction': 2, 'analysis': os.cpu_count() or 2, 'matching': 2, 'numbering': 2}
+pipeline_queue_size = 32
+# Изолированная обработка: предельное время разбора одного документа (с) и память подпроцесса (МБ)
+sandbox_timeout = 120
+sandbox_memory_limit_mb = 2048
+# Бюджет памяти на один PDF при постраничной обработке (МБ): допустимый рост памяти процесса
+# с момента открытия документа, 0 - без ограничения. Проверяется раз в pdf_memory_check_pages страниц
+pdf_memory_budget_mb = 1024
+pdf_memory_check_pages = 32
+# Окно просмотра документов: высота миниатюры первой страницы (пикс.) и каталог их кэша
+preview_thumbnail_height = 48
+preview_cache_dir = os.path.join(os.path.expanduser("~"), ".docpc", "thumbnails")
 # Настройка логирования
 logging.basicConfig(filename="process.txt", level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
-def extract_data_from_pdf(pdf_path, output_dir):
+def get_pdf_render_matrix(page, budget_mb=None):
     """
-    Извлекает текст и изображения из PDF.
+    Подбирает масштаб растеризации страницы так, чтобы растр укладывался в бюджет памяти.
+    :param page: Страница fitz
+    :param budget_mb: Бюджет памяти в МБ (по умолчанию pdf_memory_budget_mb)
+    :return: Матрица масштабирования для page.get_pixmap
+    """
+    budget_mb = pdf_memory_budget_mb if budget_mb is None else budget_mb
+    if not budget_mb:
+        return fitz.Identity
+    # Под один растр отводим четверть бюджета, 3 байта на пиксель RGB
+    max_pixels = budget_mb * 1024 * 1024 // 4 // 3
+    pixels = page.rect.width * page.rect.height
+    if pixels <= max_pixels:
+        return fitz.Identity
+    scale = (max_pixels / pixels) ** 0.5
+    logging.warning(f"Страница {page.number + 1} слишком велика, разрешение растра снижено до {scale:.2f}")
+    return fitz.Matrix(scale, scale)
+
+
+current_process = psutil.Process()
+# Выполняется ли код в подпроцессе изолированной обработки (см. run_sandbox_worker)
+in_sandbox = False
+
+
+def is_out_of_memory(error):
+    """
+    :return: True для нехватки памяти: MemoryError или ENOMEM при выделении сверх лимита RLIMIT_AS
+    """
+    return isinstance(error, MemoryError) or (isinstance(error, OSError) and error.errno == errno.ENOMEM)
+
+
+def raise_if_out_of_memory(error):
+    """
+    Пробрасывает из общего except нехватку памяти в подпроцессе изолированной обработки:
+    иначе документ попал бы в опись пустым, а не в карантин.
+    """
+    if in_sandbox and is_out_of_memory(error):
+        raise error
+
+
+class PdfMemoryGuard:
+    """
+    Ограничивает рост памяти при постраничной обработке одного PDF. Рост отсчитывается от памяти
+    процесса в момент открытия документа, поэтому pandas, Tk и кэши приложения в бюджет не входят.
+    При превышении освобождается кэш PyMuPDF, и отсчёт начинается заново, чтобы очистка
+    не повторялась на каждой следующей странице, если память не вернулась системе.
+    """
+
+    def __init__(self, budget_mb=None):
+        """
+        :param budget_mb: Бюджет памяти в МБ (по умолчанию pdf_memory_budget_mb)
+        """
+        budget_mb = pdf_memory_budget_mb if budget_mb is None else budget_mb
+        self.limit = budget_mb * 1024 * 1024
+        self.baseline = current_process.memory_info().rss if self.limit else 0
+        self.pages = 0
+
+    def page_done(self):
+        """Вызывается после обработки каждой страницы."""
+        if not self.limit:
+            return
+        self.pages += 1
+        if self.pages % pdf_memory_check_pages:
+            return
+        if current_process.memory_info().rss - self.baseline > self.limit:
+            fitz.TOOLS.store_shrink(100)
+            self.baseline = current_process.memory_info().rss
+
+
+def iter_pdf_pages_data(pdf_path, output_dir):
+    """
+    Постранично извлекает текст и изображения из PDF, не удерживая документ в памяти целиком.
     :param pdf_path: Путь к PDF файлу
     :param output_dir: Директория для сохранения изображений
-    :return: Извлечённый текст
+    :return: Генератор текста страниц
     """
-    try:
-        data = ""
-        with fitz.open(pdf_path) as pdf_file:
-            for i, page in enumerate(pdf_file):
-                data += page.get_text()
-                # Извлечение изображений
-                images = page.get_images(full=True)
-                for img_index, img in enumerate(images):
-                    xref = img[0]
+    max_image_bytes = pdf_memory_budget_mb * 1024 * 1024 // 4
+    with fitz.open(pdf_path) as pdf_file:
+        memory_guard = PdfMemoryGuard()
+        for i in range(pdf_file.page_count):
+            page = pdf_file.load_page(i)
+            text = page.get_text()
+            # Извлечение изображений
+            images = page.get_images(full=True)
+            for img_index, img in enumerate(images):
+                xref, width, height = img[0], img[2], img[3]
+                if max_image_bytes and width * height * 4 > max_image_bytes:
+                    # Слишком большое изображение сохраняем без декодирования
+                    raw = pdf_file.extract_image(xref)
+                    image_path = os.path.join(output_dir, f"page_{i + 1}_image_{img_index + 1}.{raw['ext']}")
+                    with open(image_path, "wb") as f:
+                        f.write(raw["image"])
+                    raw = None
+                else:
                     pix = fitz.Pixmap(pdf_file, xref)
                     if pix.n > 4:  # если изображение в формате CMYK, конвертируем в RGB
                         pix = fitz.Pixmap(fitz.csRGB, pix)
                     image_path = os.path.join(output_dir, f"page_{i + 1}_image_{img_index + 1}.png")
                     pix.save(image_path)
-                    logging.info(f"Изображение сохранено: {image_path}")
                     pix = None  # освобождение памяти
+                logging.info(f"Изображение сохранено: {image_path}")
+            page = None
+            yield text
+            memory_guard.page_done()
+
+
+def extract_data_from_pdf(pdf_path, output_dir):
+    """
+    Извлекает текст и изображения из PDF.
+    :param pdf_path: Путь к PDF файлу
+    :param output_dir: Директория для сохранения изображений
+    :return: Извлечённый текст
+    """
+    try:
+        data = "".join(iter_pdf_pages_data(pdf_path, output_dir))
         logging.info(f"Текст успешно извлечён из {pdf_path}")
         return data
     except Exception as e:
+        raise_if_out_of_memory(e)
         logging.error(f"Ошибка при извлечении текста из {pdf_path}: {str(e)}")
         return ""
 
 
+def get_docx_text_parts(archive):
+    """
+    Возвращает части DOCX с текстом в порядке вывода: верхние колонтитулы, тело документа, нижние колонтитулы.
+    :param archive: Открытый zipfile.ZipFile документа
+    :return: Список имён частей внутри архива
+    """
+    names = archive.namelist()
+
+    def part_number(name):
+        digits = re.findall(r"\d+", os.path.basename(name))
+        return int(digits[-1]) if digits else 0
+
+    headers = sorted((n for n in names if re.match(r"word/header\d*\.xml$", n)), key=part_number)
+    footers = sorted((n for n in names if re.match(r"word/footer\d*\.xml$", n)), key=part_number)
+    return headers + ["word/document.xml"] + footers
+
+
+def iter_docx_xml_paragraphs(xml_file, stats=None):
+    """
+    Потоково разбирает часть WordprocessingML и возвращает текст абзацев, включая таблицы и надписи.
+    Обработанные элементы сразу удаляются из дерева, поэтому память не растёт с размером документа.
+    :param xml_file: Файловый объект XML-части
+    :param stats: Словарь, в котором подсчитывается количество разделов ('sections')
+    :return: Генератор текста абзацев
+    """
+    fallback_depth = 0
+    for event, elem in etree.iterparse(xml_file, events=("start", "end")):
+        if stats is not None and event == "end" and elem.tag == W_NS + "sectPr":
+            stats['sections'] = stats.get('sections', 0) + 1
+        # Содержимое mc:Fallback дублирует mc:Choice (например, надписи в старом формате)
+        if elem.tag == MC_FALLBACK:
+            fallback_depth += 1 if event == "start" else -1
+            if event == "end":
+                elem.clear()
+            continue
+        if event != "end" or elem.tag != W_NS + "p":
+            continue
+        if not fallback_depth:
+            parts = []
+            for node in elem.iter(W_NS + "t", W_NS + "tab", W_NS + "br", W_NS + "cr"):
+                if node.tag == W_NS + "t":
+                    parts.append(node.text or "")
+                elif node.tag == W_NS + "tab":
+                    parts.append("\t")
+                else:
+                    parts.append("\n")
+            yield "".join(parts)
+        # Вложенные абзацы (надписи) уже выведены и очищены, повторно они не попадут в текст
+        elem.clear(keep_tail=True)
+        while elem.getprevious() is not None:
+            del elem.getparent()[0]
+
+
+def extract_text_from_docx_xml(docx_path):
+    """
+    Извлекает полный текст DOCX (тело, таблицы, колонтитулы, надписи) без построения модели python-docx.
+    :param docx_path: Путь к документу Word
+    :return: Извлечённый текст в порядке документа
+    """
+    with zipfile.ZipFile(docx_path) as archive:
+        return read_docx_archive_text(archive)
+
+
+def read_docx_archive_text(archive, stats=None, limit=None):
+    """
+    Извлекает текст из уже открытого архива DOCX.
+    :param archive: Открытый zipfile.ZipFile документа
+    :param stats: Словарь для статистики тела документа (см. iter_docx_xml_paragraphs)
+    :param limit: Сколько символов текста нужно (None - весь текст); тело документа
+                  при этом всё равно разбирается до конца, чтобы собрать stats
+    :return: Извлечённый текст в порядке документа
+    """
+    paragraphs = []
+    size = 0
+    for part in get_docx_text_parts(archive):
+        part_stats = stats if part == "word/document.xml" else None
+        if limit is not None and size >= limit and part_stats is None:
+            continue
+        with archive.open(part) as xml_file:
+            for paragraph in iter_docx_xml_paragraphs(xml_file, part_stats):
+                if limit is None or size < limit:
+                    paragraphs.append(paragraph)
+                    size += len(paragraph) + 1
+    return "\n".join(paragraphs)
+
+
 def extract_data_from_docx(docx_path, output_dir):
     """
     Извлекает текст и изображения из документа Word (.docx).
@@ -61,25 +293,97 @@ def extract_data_from_docx(docx_path, output_dir):
     :return: Извлечённый текст
     """
     try:
-        doc = Document(docx_path)
-        data = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+        data = extract_text_from_docx_xml(docx_path)
 
         # Извлечение изображений
-        for rel in doc.rels.values():
-            if "image" in rel.target_ref:
-                img = rel.target_part.blob
-                image_path = os.path.join(output_dir, f"{rel.target_ref.split('/')[-1]}")
-                with open(image_path, "wb") as f:
-                    f.write(img)
-                logging.info(f"Изображение сохранено: {image_path}")
+        with zipfile.ZipFile(docx_path) as archive:
+            for part in archive.namelist():
+                if part.startswith("word/media/"):
+                    image_path = os.path.join(output_dir, os.path.basename(part))
+                    with open(image_path, "wb") as f:
+                        f.write(archive.read(part))
+                    logging.info(f"Изображение сохранено: {image_path}")
 
         logging.info(f"Текст успешно извлечён из {docx_path}")
         return data
     except Exception as e:
+        raise_if_out_of_memory(e)
         logging.error(f"Ошибка при извлечении текста из {docx_path}: {str(e)}")
         return ""
 
 
+def count_txt_lines(txt_path, chunk_size=16 * 1024 * 1024):
+    """
+    Считает строки текстового файла по отображённым в память байтам, без декодирования.
+    :param txt_path: Путь к текстовому файлу
+    :param chunk_size: Размер просматриваемого за раз участка, байт
+    :return: Количество символов перевода строки
+    """
+    count = 0
+    with open(txt_path, "rb") as file:
+        if os.fstat(file.fileno()).st_size == 0:
+            return 0  # пустой файл нельзя отобразить в память
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for start in range(0, len(data), chunk_size):
+                count += data[start:start + chunk_size].count(b"\n")
+    return count
+
+
+# Метки порядка байтов и кодировки, в которых номер пишется после метки.
+# UTF-32 LE проверяется раньше UTF-16 LE: её метка начинается с тех же байтов
+TXT_BYTE_ORDER_MARKS = {
+    codecs.BOM_UTF32_LE: "utf-32-le",
+    codecs.BOM_UTF32_BE: "utf-32-be",
+    codecs.BOM_UTF8: "utf-8",
+    codecs.BOM_UTF16_LE: "utf-16-le",
+    codecs.BOM_UTF16_BE: "utf-16-be",
+}
+
+
+def detect_txt_encoding(txt_path):
+    """
+    Определяет кодировку текстового файла по начальному фрагменту.
+    :param txt_path: Путь к текстовому файлу
+    :return: Название кодировки для open()
+    """
+    with open(txt_path, "rb") as file:
+        sample = file.read(txt_encoding_sample_size)
+    if sample.startswith(b"\xef\xbb\xbf"):
+        return "utf-8-sig"
+    # Фрагмент обрезается по последней строке, чтобы не разрезать многобайтовый символ
+    if len(sample) == txt_encoding_sample_size and b"\n" in sample:
+        sample = sample[:sample.rindex(b"\n") + 1]
+    try:
+        sample.decode("utf-8")
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+    best = from_bytes(sample).best()
+    # На коротких однообразных фрагментах кириллица в cp1251 может быть принята за другую кодировку
+    chaos = {match.encoding: match.chaos for match in from_bytes(sample, cp_isolation=txt_preferred_encodings)}
+    if chaos:
+        lowest = min(chaos.values())
+        if best is None or lowest <= best.chaos:
+            # При равном качестве декодирования выбирается кодировка, стоящая в списке раньше
+            return next(encoding for encoding in txt_preferred_encodings if chaos.get(encoding) == lowest)
+    return best.encoding if best else "utf-8"
+
+
+def iter_txt_chunks(txt_path, chunk_size=1024 * 1024):
+    """
+    Потоково декодирует текстовый файл в определённой кодировке.
+    :param txt_path: Путь к текстовому файлу
+    :param chunk_size: Размер блока в символах
+    :return: Генератор фрагментов текста
+    """
+    with open(txt_path, "r", encoding=detect_txt_encoding(txt_path), errors="replace") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
 def extract_data_from_txt(txt_path):
     """
     Извлекает текст из текстового файла (.txt).
@@ -87,11 +391,11 @@ def extract_data_from_txt(txt_path):
     :return: Извлечённый текст
     """
     try:
-        with open(txt_path, "r", encoding="utf-8") as file:
-            data = file.read()
+        data = "".join(iter_txt_chunks(txt_path))
         logging.info(f"Текст успешно извлечён из {txt_path}")
         return data
     except Exception as e:
+        raise_if_out_of_memory(e)
         logging.error(f"Ошибка при извлечении текста из {txt_path}: {str(e)}")
         return ""
 
@@ -127,21 +431,24 @@ def extract_data_from_xlsx(xlsx_path):
         logging.info(f"Текст успешно извлечён из {xlsx_path}")
         return data
     except Exception as e:
+        raise_if_out_of_memory(e)
         logging.error(f"Ошибка при извлечении текста из {xlsx_path}: {str(e)}")
         return ""
 
 
-def extract_archive(file_path, extract_to):
+def extract_archive(file_path, extract_to, interactive=True):
     """
     Извлекает файлы из архива в указанную директорию.
 
     :param file_path: Путь к архивному файлу
     :param extract_to: Директория для извлечения
+    :param interactive: Показывать ли диалоги (False при вызове из рабочих потоков конвейера)
     :return: True, если извлечение прошло успешно, иначе False
     """
     if not file_path or not extract_to:
         logging.error("Необходимо указать расположение архива и место для разархивации.")
-        messagebox.showerror("Ошибка", "Необходимо указать расположение архива и место для разархивации.")
+        if interactive:
+            messagebox.showerror("Ошибка", "Необходимо указать расположение архива и место для разархивации.")
         return False
 
     try:
@@ -167,43 +474,72 @@ def extract_archive(file_path, extract_to):
 
         else:
             logging.error("Неподдерживаемый формат архива.")
-            messagebox.showerror("Ошибка", "Неподдерживаемый формат архива.")
+            if interactive:
+                messagebox.showerror("Ошибка", "Неподдерживаемый формат архива.")
             return False
 
-        messagebox.showinfo("Успех", f"Архив успешно извлечён в {extract_to}")
+        if interactive:
+            messagebox.showinfo("Успех", f"Архив успешно извлечён в {extract_to}")
         return True
 
     except rarfile.Error as e:
         logging.error(f"Ошибка при извлечении RAR-архива {file_path}: {str(e)}")
-        messagebox.showerror("Ошибка", f"Не удалось извлечь RAR-архив. {str(e)}")
+        if interactive:
+            messagebox.showerror("Ошибка", f"Не удалось извлечь RAR-архив. {str(e)}")
         return False
 
     except (zipfile.BadZipFile, py7zr.Bad7zFile) as e:
         logging.error(f"Ошибка: архив повреждён или имеет неверный формат {file_path}: {str(e)}")
-        messagebox.showerror("Ошибка", "Архив повреждён или имеет неверный формат.")
+        if interactive:
+            messagebox.showerror("Ошибка", "Архив повреждён или имеет неверный формат.")
         return False
 
     except PermissionError:
         logging.error(f"Ошибка: недостаточно прав для записи в {extract_to}.")
-        messagebox.showerror("Ошибка", "Недостаточно прав для записи в указанную директорию.")
+        if interactive:
+            messagebox.showerror("Ошибка", "Недостаточно прав для записи в указанную директорию.")
         return False
 
     except Exception as e:
         logging.error(f"Ошибка извлечения файла {file_path}: {str(e)}")
-        messagebox.showerror("Ошибка", "Ошибка при извлечении архива.")
+        if interactive:
+            messagebox.showerror("Ошибка", "Ошибка при извлечении архива.")
         return False
 
+def list_archive_members(file_path):
+    """
+    Возвращает пути файлов внутри архива без его распаковки.
+    :param file_path: Путь к архивному файлу
+    :return: Список относительных путей файлов
+    """
+    if file_path.endswith('.zip'):
+        with zipfile.ZipFile(file_path, 'r') as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+    if file_path.endswith('.rar'):
+        with rarfile.RarFile(file_path, 'r') as archive:
+            return [info.filename for info in archive.infolist() if not info.is_dir()]
+    if file_path.endswith('.7z'):
+        with py7zr.SevenZipFile(file_path, mode='r') as archive:
+            return [info.filename for info in archive.list() if not info.is_directory]
+    return []
+
+
 def extract_text_from_pdf(pdf_path):
     text = ""
     try:
         with fitz.open(pdf_path) as pdf:
+            memory_guard = PdfMemoryGuard()
             for page_num in range(len(pdf)):
                 page = pdf[page_num]
                 text += page.get_text("text")
                 if not text.strip():
-                    pix = page.get_pixmap()
+                    pix = page.get_pixmap(matrix=get_pdf_render_matrix(page))
                     image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                    pix = None
                     text += pytesseract.image_to_string(image)
+                    image = None
+                page = None
+                memory_guard.page_done()
     except Exception as e:
         logging.error(f"Ошибка извлечения текста из PDF {pdf_path}: {str(e)}")
     return text
@@ -211,8 +547,7 @@ def extract_text_from_pdf(pdf_path):
 
 def extract_text_from_docx(docx_path):
     try:
-        doc = Document(docx_path)
-        return "\n".join([para.text for para in doc.paragraphs])
+        return extract_text_from_docx_xml(docx_path)
     except Exception as e:
         logging.error(f"Ошибка извлечения текста из DOCX {docx_path}: {str(e)}")
     return ""
@@ -239,47 +574,296 @@ def compare_with_reference(data, reference_path):
     return []
 
 
-def extract_file_metadata(file_path):
+def detect_designation(name, text=""):
     """
-    Извлекает метаданные о документе.
+    Определяет обозначение документа: сначала по имени файла, затем по началу текста.
+    :param name: Имя файла
+    :param text: Текст документа
+    :return: Обозначение или имя файла без расширения, если код не найден
+    """
+    stem = os.path.splitext(name)[0]
+    match = DESIGNATION_PATTERN.search(stem) or DESIGNATION_PATTERN.search(text[:designation_search_chars])
+    return match.group(1) if match else stem
+
+
+def analyze_document(file_path, with_text=True, ocr=False):
+    """
+    Открывает документ один раз и собирает всё, что нужно этапам обработки:
+    количество страниц, текст, ссылки на изображения и обозначение.
     :param file_path: Путь к файлу
-    :return: Кортеж с наименованием, обозначением, количеством страниц и форматом
+    :param with_text: Извлекать ли текст и ссылки на изображения. Без этого читается и возвращается в text
+                      только начало текста (designation_search_chars символов), в котором ищется обозначение,
+                      поэтому обозначение совпадает с полным разбором
+    :param ocr: Распознавать ли страницы PDF без текстового слоя (как extract_text_from_pdf)
+    :return: Словарь с ключами path, name, format, pages, text, images, designation
     """
-    # Получаем имя файла и его формат
     name = os.path.basename(file_path)
     format = os.path.splitext(file_path)[1][1:].lower()  # Формат файла без точки
-
-    designation = "Обозначение документа"  # Заглушка, заменить на реальное значение, если доступно
-    pages = 0  # Количество страниц, инициализируем как 0
+    record = {'path': file_path, 'name': name, 'format': format, 'pages': 0, 'text': "", 'images': []}
+    limit = None if with_text else designation_search_chars
+    text = ""
 
     try:
-        # Обработка файлов PDF
         if format == 'pdf':
-            with open(file_path, 'rb') as file:
-                reader = PyPDF2.PdfReader(file)
-                pages = len(reader.pages)  # Получаем количество страниц в PDF
+            with fitz.open(file_path) as pdf:
+                record['pages'] = pdf.page_count
+                pages_text = []
+                text_size = 0
+                has_text = False
+                memory_guard = PdfMemoryGuard()
+                for page_num in range(pdf.page_count):
+                    if limit is not None and text_size >= limit:
+                        break
+                    page = pdf.load_page(page_num)
+                    page_text = page.get_text()
+                    has_text = has_text or bool(page_text.strip())
+                    if ocr and not has_text:
+                        pix = page.get_pixmap(matrix=get_pdf_render_matrix(page))
+                        image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+                        pix = None
+                        page_text = pytesseract.image_to_string(image)
+                        image = None
+                    pages_text.append(page_text)
+                    text_size += len(page_text) + 1
+                    if with_text:
+                        record['images'].extend((page_num + 1, img[0]) for img in page.get_images(full=True))
+                    page = None
+                    memory_guard.page_done()
+                text = "\n".join(pages_text)
 
-        # Обработка файлов DOCX
         elif format == 'docx':
-            doc = docx.Document(file_path)
-            pages = len(doc.element.xpath('//w:sectPr'))  # Пример получения количества страниц
+            with zipfile.ZipFile(file_path) as archive:
+                stats = {}
+                text = read_docx_archive_text(archive, stats, limit)
+                if with_text:
+                    record['images'] = [part for part in archive.namelist() if part.startswith("word/media/")]
+                record['pages'] = stats.get('sections', 0)  # Пример получения количества страниц
 
-        # Обработка текстовых файлов
         elif format == 'txt':
-            with open(file_path, 'r', encoding='utf-8') as file:
-                content = file.read()
-                pages = content.count('\n') // 50 + 1  # Примерное количество страниц
+            record['pages'] = count_txt_lines(file_path) // 50 + 1  # Примерное количество страниц
+            if with_text:
+                text = "".join(iter_txt_chunks(file_path))
+            else:
+                text = next(iter_txt_chunks(file_path, limit), "")
+
+        elif format == 'xlsx':
+            workbook = load_workbook(filename=file_path, read_only=True)
+            record['pages'] = len(workbook.sheetnames)
+            workbook.close()
 
         # Обработка изображений (например, сканированных документов)
         elif format in ['jpg', 'jpeg', 'png']:
-            img = Image.open(file_path)
-            text = pytesseract.image_to_string(img)  # Извлечение текста из изображения
-            pages = 1  # Для изображений, можно считать 1 страницу, если изображение одно
+            record['pages'] = 1  # Для изображений, можно считать 1 страницу, если изображение одно
+            if with_text:
+                text = pytesseract.image_to_string(Image.open(file_path))
+                record['images'] = [file_path]
 
     except Exception as e:
-        logging.error(f"Ошибка при извлечении метаданных из файла {file_path}: {str(e)}")
+        raise_if_out_of_memory(e)
+        logging.error(f"Ошибка при анализе файла {file_path}: {str(e)}")
+
+    record['text'] = text if with_text else text[:limit]
+    record['designation'] = detect_designation(name, text)
+    return record
+
+
+def extract_file_metadata(file_path):
+    """
+    Извлекает метаданные о документе.
+    :param file_path: Путь к файлу
+    :return: Кортеж с наименованием, обозначением, количеством страниц и форматом
+    """
+    record = analyze_document(file_path, with_text=False)
+    return record['name'], record['designation'], record['pages'], record['format']
+
+
+def make_placeholder_thumbnail(label, height):
+    """
+    Заглушка миниатюры для документов, первую страницу которых не отрисовать (DOCX, TXT, XLSX).
+    """
+    image = Image.new("RGB", (height * 3 // 4, height), "white")
+    draw = ImageDraw.Draw(image)
+    draw.rectangle([0, 0, image.width - 1, height - 1], outline="gray")
+    draw.text((4, height // 2 - 6), label.upper()[:4], fill="gray")
+    return image
+
+
+def render_document_thumbnail(file_path, height=None):
+    """
+    Миниатюра первой страницы документа в низком разрешении и количество страниц.
+    :param file_path: Путь к файлу
+    :param height: Высота миниатюры (по умолчанию preview_thumbnail_height)
+    :return: Кортеж (изображение PIL, количество страниц)
+    """
+    height = height or preview_thumbnail_height
+    format = os.path.splitext(file_path)[1][1:].lower()
+    if format == 'pdf':
+        with fitz.open(file_path) as pdf:
+            pages = pdf.page_count
+            page = pdf.load_page(0)
+            zoom = height / max(page.rect.height, 1)
+            pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+            image = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+            pix = page = None
+        return image, pages
+    return make_placeholder_thumbnail(format, height), analyze_document(file_path, with_text=False)['pages']
+
+
+def get_reference_key(reference_dict):
+    """
+    :return: Отпечаток справочника: совпадения по содержимому в кэше просмотра действительны только для него
+    """
+    if not reference_dict:
+        return ""
+    data = json.dumps(sorted(reference_dict.items()), ensure_ascii=False)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
+
+
+def load_document_preview(content_hash, reference_key="", height=None):
+    """
+    Читает из кэша на диске миниатюру, количество страниц и совпадение со справочником по содержимому.
+    :param content_hash: SHA-256 содержимого файла
+    :param reference_key: Результат get_reference_key для текущего справочника
+    :return: Кортеж (изображение PIL, количество страниц, совпадение или None) либо None, если в кэше нет
+    """
+    height = height or preview_thumbnail_height
+    cache_path = os.path.join(preview_cache_dir, f"{content_hash}-{height}.png")
+    try:
+        with Image.open(cache_path) as cached:
+            cached.load()
+            if cached.text.get("reference", "") != reference_key:
+                return None  # справочник изменился, совпадение нужно найти заново
+            return cached.convert("RGB"), int(cached.text.get("pages", 0)), cached.text.get("match") or None
+    except OSError:
+        return None
+
+
+def preview_document(file_path, reference_dict=None, height=None):
+    """
+    Данные строки окна просмотра: миниатюра первой страницы, количество страниц и первое название
+    из справочника, найденное в тексте (как при переименовании по содержимому).
+    Результат кэшируется на диске по хэшу содержимого, поэтому переименованные и скопированные
+    файлы повторно не разбираются; количество страниц и совпадение хранятся в метаданных PNG.
+    :param file_path: Путь к файлу
+    :param reference_dict: Результат load_rename_dictionary или None
+    :param height: Высота миниатюры (по умолчанию preview_thumbnail_height)
+    :return: Кортеж (изображение PIL, количество страниц, совпадение или None, хэш содержимого)
+    """
+    height = height or preview_thumbnail_height
+    content_hash = hash_file(file_path)
+    reference_key = get_reference_key(reference_dict)
+    cached = load_document_preview(content_hash, reference_key, height)
+    if cached is not None:
+        return cached + (content_hash,)
+
+    image, pages = render_document_thumbnail(file_path, height)
+    match = None
+    if reference_dict:
+        text = read_file_content(file_path, os.path.splitext(file_path)[1])
+        match = next(find_reference_matches(text, reference_dict), None) if text else None
+
+    os.makedirs(preview_cache_dir, exist_ok=True)
+    info = PngImagePlugin.PngInfo()
+    info.add_text("pages", str(pages))
+    info.add_text("reference", reference_key)
+    info.add_text("match", match or "")
+    cache_path = os.path.join(preview_cache_dir, f"{content_hash}-{height}.png")
+    temp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(temp_path, "PNG", pnginfo=info)
+    os.replace(temp_path, cache_path)
+    return image, pages, match, content_hash
+
+
+def walk_sorted(directory):
+    """
+    os.walk с постоянным порядком: подкаталоги и файлы по имени. Порядок os.walk зависит
+    от файловой системы, а этот совпадает с DocumentRecord.sort_key, поэтому опись, нумерация
+    и распределённая опись перечисляют одни и те же файлы одинаково.
+    """
+    for root, dirs, files in os.walk(directory):
+        dirs.sort(key=os.path.normcase)
+        yield root, dirs, sorted(files, key=os.path.normcase)
+
+
+class DocumentRecord:
+    """
+    Компактная запись описи о документе. Вместо словаря на каждый файл хранятся слоты,
+    каталог и формат интернируются и разделяются всеми файлами одного каталога и формата,
+    а номер хранится отдельно от наименования и подставляется только при отображении.
+    Поддерживает обращение как к словарю (document['name'] и т.п.) для прежнего кода.
+    """
+
+    __slots__ = ('directory', 'filename', 'title', 'designation', 'pages', 'format', 'number')
+
+    FIELDS = ('name', 'designation', 'pages', 'format')
+
+    def __init__(self, file_path, designation, pages, format=None):
+        directory, filename = os.path.split(file_path)
+        self.directory = sys.intern(directory)
+        self.filename = filename
+        self.title = None  # наименование по справочнику; по умолчанию имя файла
+        self.designation = designation
+        self.pages = pages
+        self.format = sys.intern(format if format is not None else os.path.splitext(filename)[1][1:].lower())
+        self.number = None
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.filename)
+
+    @property
+    def name(self):
+        """Отображаемое наименование: номер в описи и наименование документа."""
+        title = self.title if self.title is not None else self.filename
+        return title if self.number is None else f"{self.number}. {title}"
+
+    @name.setter
+    def name(self, value):
+        self.title = value
+        self.number = None
 
-    return name, designation, pages, format
+    @staticmethod
+    def path_sort_key(file_path):
+        """Порядок обхода walk_sorted: файлы каталога по имени раньше подкаталогов, подкаталоги по имени."""
+        directory, filename = os.path.split(os.path.normcase(file_path))
+        return directory.split(os.sep), filename
+
+    def sort_key(self):
+        return self.path_sort_key(self.path)
+
+    def __getitem__(self, key):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.FIELDS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def get(self, key, default=None):
+        return getattr(self, key) if key in self.FIELDS else default
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def keys(self):
+        return self.FIELDS
+
+    def values(self):
+        return [getattr(self, key) for key in self.FIELDS]
+
+    def items(self):
+        return [(key, getattr(self, key)) for key in self.FIELDS]
+
+    def as_dict(self):
+        return {key: getattr(self, key) for key in self.FIELDS}
 
 
 def create_inventory(matched_data, output_path):
@@ -335,7 +919,7 @@ def extract_data_from_documents(directory):
 
 
 
-def apply_number_to_file(file_path, number, output_path):
+def apply_number_to_file(file_path, number, output_path, interactive=True):
     ext = os.path.splitext(file_path)[-1].lower()
 
     try:
@@ -359,10 +943,27 @@ def apply_number_to_file(file_path, number, output_path):
 
         # Нанесение номера на .txt
         elif ext == ".txt":
-            with open(file_path, "r", encoding="utf-8") as f:
-                content = f.read()
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(f"Номер: {number}\n{content}")
+            # Кодируется только строка с номером, а байты файла копируются без изменений:
+            # при неточно угаданной кодировке перекодирование испортило бы текст
+            encoding = detect_txt_encoding(file_path)
+            with open(file_path, "rb") as source:
+                head = source.read(4)
+                # Метка порядка байтов остаётся в начале файла, перед номером
+                bom = next((mark for mark in TXT_BYTE_ORDER_MARKS if head.startswith(mark)), b"")
+                if bom:
+                    encoding = TXT_BYTE_ORDER_MARKS[bom]
+                try:
+                    stamp = f"Номер: {number}{os.linesep}".encode(encoding)
+                except UnicodeEncodeError:
+                    # В найденной кодировке нет кириллицы: номер пишется латиницей, а не "?????"
+                    logging.warning(f"Кодировка {encoding} файла {file_path} не содержит кириллицы, номер записан латиницей")
+                    stamp = f"No. {number}{os.linesep}".encode(encoding)
+                source.seek(len(bom))
+                temp_output_path = output_path + "_temp.txt"
+                with open(temp_output_path, "wb") as f:
+                    f.write(bom + stamp)
+                    shutil.copyfileobj(source, f)
+            shutil.move(temp_output_path, output_path)
 
         # Нанесение номера на .xlsx
         elif ext == ".xlsx":
@@ -372,10 +973,14 @@ def apply_number_to_file(file_path, number, output_path):
             workbook.save(output_path)
 
         logging.info(f"Номер {number} успешно нанесен на файл {file_path} и сохранен как {output_path}")
+        return True
 
     except Exception as e:
+        raise_if_out_of_memory(e)
         logging.error(f"Ошибка нанесения номера на файл {file_path}: {str(e)}")
-        messagebox.showerror("Ошибка", f"Ошибка при нанесении номера на файл {file_path}: {str(e)}")
+        if interactive:
+            messagebox.showerror("Ошибка", f"Ошибка при нанесении номера на файл {file_path}: {str(e)}")
+        return False
 
 
 def rename_file_with_dialog():
@@ -409,21 +1014,25 @@ def read_file_content(file_path, ext):
     :return: Содержимое файла в виде строки
     """
     content = ""
-    try:
-        if ext.lower() == ".txt":
-            with open(file_path, 'r', encoding="utf-8", errors="ignore") as f:
-                content = f.read()
-        elif ext.lower() == ".docx":
-            doc = Document(file_path)
-            content = "\n".join([para.text for para in doc.paragraphs])
-        elif ext.lower() == ".pdf":
-            pdf_reader = PdfReader(file_path)
-            content = "\n".join([page.extract_text() for page in pdf_reader.pages])
+    if ext.lower() in (".txt", ".docx", ".pdf"):
+        content = analyze_document(file_path)['text']
         logging.debug(f"Содержимое файла '{file_path}': {content[:100]}...")
-    except Exception as e:
-        logging.error(f"Ошибка при чтении содержимого файла '{file_path}': {str(e)}")
-
     return content
+
+
+def find_reference_matches(text, reference_dict):
+    """
+    Названия из справочника, упомянутые в тексте документа (сопоставление по содержимому).
+    :param text: Текст документа
+    :param reference_dict: Результат load_rename_dictionary
+    :return: Генератор русских названий в порядке справочника
+    """
+    return (
+        new_name for ref_name, new_name in reference_dict.items()
+        if re.search(rf"\b{re.escape(ref_name)}\b", text, re.IGNORECASE)
+    )
+
+
 def check_and_rename_files(directory):
     """Проверяет и переименовывает файлы в каталоге, чтобы соответствовать определённому шаблону именования."""
     pattern = re.compile(r"^[A-Za-z0-9_-]+$")
@@ -433,6 +1042,768 @@ def check_and_rename_files(directory):
             os.rename(os.path.join(directory, filename), os.path.join(directory, new_filename))
             logging.info(f"Файл переименован: {filename} -> {new_filename}")
 
+
+def hash_file(file_path, limit=None, chunk_size=1024 * 1024):
+    """
+    Вычисляет хэш содержимого файла.
+    :param file_path: Путь к файлу
+    :param limit: Сколько байт с начала файла учитывать (None - весь файл)
+    :param chunk_size: Размер блока чтения
+    :return: Шестнадцатеричный SHA-256
+    """
+    digest = hashlib.sha256()
+    remaining = limit
+    with open(file_path, "rb") as f:
+        while remaining is None or remaining > 0:
+            block = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not block:
+                break
+            digest.update(block)
+            if remaining is not None:
+                remaining -= len(block)
+    return digest.hexdigest()
+
+
+def find_duplicate_files(file_paths, partial_size=64 * 1024):
+    """
+    Находит группы одинаковых файлов: сначала по размеру, затем по хэшу начала файла, затем по полному хэшу.
+    :param file_paths: Список путей к файлам
+    :param partial_size: Размер начального фрагмента для частичного хэша
+    :return: Список групп дубликатов; первый файл группы - представитель
+    """
+    def group_by(paths, key):
+        groups = {}
+        for path in paths:
+            try:
+                groups.setdefault(key(path), []).append(path)
+            except OSError as e:
+                logging.error(f"Ошибка при чтении файла {path} для поиска дубликатов: {str(e)}")
+        return [group for group in groups.values() if len(group) > 1]
+
+    duplicate_groups = []
+    for same_size in group_by(sorted(set(file_paths)), os.path.getsize):
+        # Файлы не длиннее частичного фрагмента уже полностью сравнены частичным хэшем
+        if os.path.getsize(same_size[0]) <= partial_size:
+            duplicate_groups.extend(group_by(same_size, lambda path: hash_file(path, partial_size)))
+            continue
+        for same_start in group_by(same_size, lambda path: hash_file(path, partial_size)):
+            duplicate_groups.extend(group_by(same_start, hash_file))
+
+    for group in duplicate_groups:
+        logging.info(f"Найдены одинаковые файлы: {group}")
+    return duplicate_groups
+
+
+def build_duplicate_index(duplicate_groups):
+    """
+    Строит соответствие путь файла -> путь представителя его группы дубликатов.
+    :param duplicate_groups: Результат find_duplicate_files
+    :return: Словарь для файлов-дубликатов (представители в него не входят)
+    """
+    return {
+        os.path.normpath(path): os.path.normpath(group[0])
+        for group in duplicate_groups
+        for path in group[1:]
+    }
+
+
+class RunJournal:
+    """
+    Журнал выполнения длительного запуска: какие шаги (extracted, numbered, renamed, inventoried)
+    уже выполнены для каждого файла. Записи дописываются в файл JSON Lines сразу после шага,
+    поэтому прерванный запуск продолжается с последней контрольной точки.
+    Журнал хранится вне обрабатываемой директории, чтобы не попасть в нумерацию и опись,
+    и удаляется после успешного завершения запуска.
+    Вместе с шагом файла сохраняются его размер и время изменения: если файл с тех пор заменён,
+    запись журнала не учитывается и шаг выполняется заново.
+    """
+
+    # Шаги, повтор которых испортил бы файл (второй номер), сразу передаются ОС,
+    # чтобы пережить аварийное завершение приложения
+    IMMEDIATE_STEPS = ('numbered',)
+
+    def __init__(self, directory, run_name):
+        key = hashlib.sha1(os.path.abspath(directory).encode("utf-8")).hexdigest()
+        journal_dir = os.path.join(os.path.expanduser("~"), ".docpc", "journals")
+        os.makedirs(journal_dir, exist_ok=True)
+        self.path = os.path.join(journal_dir, f"{run_name}-{key}.jsonl")
+        self.steps = {}
+        self.resumed = os.path.exists(self.path)
+        if self.resumed:
+            self._load()
+            logging.info(f"Найден незавершённый запуск {run_name} для {directory}, продолжаем с контрольной точки")
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.lock = threading.Lock()
+        self.synced_at = time.monotonic()
+
+    @staticmethod
+    def _key(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    @staticmethod
+    def _stat(path):
+        """
+        :return: [размер, время изменения] файла или None для каталогов и отсутствующих файлов
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        if not os.path.isfile(path):
+            return None
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load(self):
+        valid_size = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                try:
+                    record = json.loads(line.decode("utf-8"))
+                except ValueError:
+                    break  # строка, оборванная при сбое, - конец журнала
+                valid_size += len(line)
+                if 'rename' in record:
+                    old, new = record['rename']
+                    if old in self.steps:
+                        self.steps[new] = self.steps.pop(old)
+                else:
+                    self.steps.setdefault(record['path'], {})[record['step']] = (record['value'], record.get('stat'))
+        # Оборванный хвост отрезается, чтобы новые записи начинались с новой строки
+        with open(self.path, "r+b") as f:
+            f.truncate(valid_size)
+
+    def _write(self, record, immediate=False):
+        # fsync на сетевом диске дорог, поэтому записи накапливаются и сбрасываются раз в journal_sync_interval
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if time.monotonic() - self.synced_at >= journal_sync_interval:
+                self._sync()
+            elif immediate:
+                self.file.flush()
+
+    def _sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.synced_at = time.monotonic()
+
+    def sync(self):
+        """
+        Сбрасывает журнал на диск (например, на границе этапов запуска).
+        """
+        with self.lock:
+            self._sync()
+
+    def get(self, step, path):
+        """
+        :return: Значение, сохранённое для шага файла, или None, если шаг не выполнялся
+                 или файл изменился после выполнения шага
+        """
+        key = self._key(path)
+        entry = self.steps.get(key, {}).get(step)
+        if entry is None:
+            return None
+        value, stat = entry
+        if stat is not None and self._stat(key) != stat:
+            logging.info(f"Файл {path} изменился после шага {step}, запись журнала не учитывается")
+            return None
+        return value
+
+    def is_done(self, step, path):
+        return self.get(step, path) is not None
+
+    def values(self, step):
+        """
+        :return: Значения шага для всех файлов, где он выполнен (без проверки изменения файлов)
+        """
+        return [steps[step][0] for steps in self.steps.values() if step in steps]
+
+    def mark(self, step, path, value=True):
+        """
+        Отмечает шаг файла выполненным.
+        :param step: Название шага
+        :param path: Путь к файлу (или архиву)
+        :param value: Результат шага, нужный при продолжении (например, номер)
+        """
+        key = self._key(path)
+        stat = self._stat(key)
+        self.steps.setdefault(key, {})[step] = (value, stat)
+        self._write({'path': key, 'step': step, 'value': value, 'stat': stat}, step in self.IMMEDIATE_STEPS)
+
+    def rename(self, old_path, new_path):
+        """
+        Переносит выполненные шаги на новое имя файла после переименования.
+        """
+        old, new = self._key(old_path), self._key(new_path)
+        if old in self.steps:
+            self.steps[new] = self.steps.pop(old)
+        self._write({'rename': [old, new]}, immediate=True)
+
+    def finish(self):
+        """
+        Закрывает журнал успешно завершённого запуска.
+        """
+        self.file.close()
+        os.remove(self.path)
+
+    def close(self):
+        """
+        Закрывает журнал, оставляя его для продолжения запуска.
+        """
+        self.sync()
+        self.file.close()
+
+
+class DocumentQuarantined(Exception):
+    """Документ не удалось разобрать в изолированном подпроцессе: превышено время или память, либо процесс упал."""
+
+
+# Функции, которые можно выполнять в изолированном подпроцессе
+SANDBOX_FUNCTIONS = (
+    'analyze_document', 'read_file_content', 'apply_number_to_file',
+    'extract_data_from_pdf', 'extract_data_from_docx', 'extract_data_from_xlsx', 'preview_document',
+)
+
+
+def run_sandbox_worker(conn, memory_limit_mb=None):
+    """
+    Цикл подпроцесса изолированной обработки: принимает вызовы из SANDBOX_FUNCTIONS и возвращает результаты.
+    :param conn: Конец multiprocessing.Pipe со стороны подпроцесса
+    :param memory_limit_mb: Лимит роста памяти подпроцесса в МБ
+    """
+    global in_sandbox
+    in_sandbox = True
+    if memory_limit_mb and resource is not None and sys.platform.startswith("linux"):
+        # В Linux лимит адресного пространства срабатывает сразу при выделении памяти,
+        # а не при следующем опросе памяти родителем
+        limit = current_process.memory_info().vms + memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+    while True:
+        try:
+            func_name, args, kwargs = conn.recv()
+        except EOFError:
+            return
+        try:
+            if func_name not in SANDBOX_FUNCTIONS:
+                raise ValueError(f"Функция {func_name} не разрешена для изолированной обработки")
+            conn.send(('ok', globals()[func_name](*args, **kwargs)))
+        except Exception as e:
+            if is_out_of_memory(e):
+                conn.send(('memory', None))
+            else:
+                conn.send(('error', str(e)))
+
+
+class DocumentSandbox:
+    """
+    Переиспользуемый подпроцесс для разбора документов. Зависание или аварийное завершение
+    PyMuPDF, python-docx или Tesseract на одном файле не останавливает пакет: подпроцесс
+    завершается по таймауту или лимиту памяти и перезапускается для следующего документа.
+    """
+
+    def __init__(self, timeout=None, memory_limit_mb=None):
+        self.timeout = timeout or sandbox_timeout
+        self.memory_limit_mb = memory_limit_mb or sandbox_memory_limit_mb
+        self.process = None
+        self.conn = None
+
+    def _start(self):
+        # spawn: fork из многопоточного процесса (конвейер) может унаследовать захваченные блокировки
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=run_sandbox_worker, args=(child_conn, self.memory_limit_mb), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+
+    def stop(self):
+        if self.process is not None:
+            if self.process.is_alive():
+                self.process.kill()
+            self.process.join()
+            self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def call(self, func_name, *args, **kwargs):
+        """
+        Выполняет функцию из SANDBOX_FUNCTIONS в подпроцессе.
+        :return: Результат функции
+        :raises DocumentQuarantined: Если превышено время или память либо подпроцесс завершился аварийно
+        """
+        if self.process is None or not self.process.is_alive():
+            self.stop()
+            self._start()
+        try:
+            self.conn.send((func_name, args, kwargs))
+        except OSError:
+            self.stop()
+            raise DocumentQuarantined("подпроцесс аварийно завершился")
+        deadline = time.monotonic() + self.timeout
+        process = psutil.Process(self.process.pid)
+
+        while not self.conn.poll(0.1):
+            reason = None
+            if not self.process.is_alive():
+                reason = f"подпроцесс аварийно завершился (код {self.process.exitcode})"
+            elif time.monotonic() > deadline:
+                reason = f"превышено время обработки {self.timeout} с"
+            else:
+                try:
+                    if process.memory_info().rss > self.memory_limit_mb * 1024 * 1024:
+                        reason = f"превышен лимит памяти {self.memory_limit_mb} МБ"
+                except psutil.Error:
+                    continue  # процесс только что завершился, причина будет определена на следующем шаге
+            if reason:
+                self.stop()
+                raise DocumentQuarantined(reason)
+
+        try:
+            status, value = self.conn.recv()
+        except (EOFError, OSError):
+            exitcode = self.process.exitcode
+            self.stop()
+            raise DocumentQuarantined(f"подпроцесс аварийно завершился (код {exitcode})")
+        if status == 'memory':
+            self.stop()
+            raise DocumentQuarantined(f"превышен лимит памяти {self.memory_limit_mb} МБ")
+        if status == 'error':
+            raise RuntimeError(value)
+        return value
+
+
+class FileTaskQueue:
+    """
+    Очередь задач на основе файлов в общей сетевой папке.
+    Задача захватывается атомарным переименованием pending/<id>.json в leased/<id>.json,
+    поэтому координатору и обработчикам не нужны внешние сервисы и блокировки.
+    Пути к документам хранятся относительно папки очереди, чтобы машины могли монтировать её по-разному.
+    """
+
+    def __init__(self, queue_dir):
+        self.queue_dir = queue_dir
+        self.pending_dir = os.path.join(queue_dir, "pending")
+        self.leased_dir = os.path.join(queue_dir, "leased")
+        self.results_dir = os.path.join(queue_dir, "results")
+        self.job_path = os.path.join(queue_dir, "job.json")
+
+    def create_job(self, file_paths):
+        """
+        Создаёт новое задание: по задаче на файл, номера задач соответствуют порядку file_paths.
+        :param file_paths: Список путей к файлам
+        """
+        for directory in (self.pending_dir, self.leased_dir, self.results_dir):
+            shutil.rmtree(directory, ignore_errors=True)
+            os.makedirs(directory)
+        for index, file_path in enumerate(file_paths):
+            task = {'id': f"{index:08d}", 'path': os.path.relpath(file_path, self.queue_dir)}
+            self._write_json(os.path.join(self.pending_dir, f"{task['id']}.json"), task)
+        self._write_json(self.job_path, {'total': len(file_paths)})
+        logging.info(f"Создано задание из {len(file_paths)} задач в очереди {self.queue_dir}")
+
+    def lease(self):
+        """
+        Захватывает первую свободную задачу.
+        :return: Кортеж (задача, путь к файлу аренды) или None, если свободных задач нет
+        """
+        if not os.path.isdir(self.pending_dir):
+            return None
+        for filename in sorted(os.listdir(self.pending_dir)):
+            pending_path = os.path.join(self.pending_dir, filename)
+            lease_path = os.path.join(self.leased_dir, filename)
+            try:
+                # Время аренды отсчитывается от захвата: переименование сохраняет время создания задачи,
+                # и задача, долго ждавшая в pending, сразу считалась бы просроченной
+                os.utime(pending_path)
+                os.rename(pending_path, lease_path)
+            except OSError:
+                continue  # задачу уже забрал другой обработчик
+            try:
+                with open(lease_path, "r", encoding="utf-8") as f:
+                    return json.load(f), lease_path
+            except OSError:
+                continue  # координатор успел вернуть задачу в очередь
+        return None
+
+    def complete(self, task, result, lease_path):
+        """
+        Записывает результат задачи и снимает аренду.
+        :param task: Задача
+        :param result: Словарь с результатом
+        :param lease_path: Путь к файлу аренды
+        """
+        self._write_json(os.path.join(self.results_dir, f"{task['id']}.json"), result)
+        try:
+            os.remove(lease_path)
+        except OSError:
+            pass  # аренда уже была возвращена в очередь координатором
+
+    def requeue_expired(self, lease_timeout):
+        """
+        Возвращает в очередь задачи обработчиков, которые перестали продлевать аренду.
+        :param lease_timeout: Время жизни аренды без продления, секунды
+        :return: Количество возвращённых задач
+        """
+        requeued = 0
+        now = time.time()
+        for filename in os.listdir(self.leased_dir):
+            lease_path = os.path.join(self.leased_dir, filename)
+            try:
+                if now - os.path.getmtime(lease_path) < lease_timeout:
+                    continue
+                if os.path.exists(os.path.join(self.results_dir, filename)):
+                    os.remove(lease_path)
+                    continue
+                os.rename(lease_path, os.path.join(self.pending_dir, filename))
+                requeued += 1
+                logging.warning(f"Задача {filename} возвращена в очередь: обработчик не отвечает")
+            except OSError:
+                continue
+        return requeued
+
+    def total(self):
+        with open(self.job_path, "r", encoding="utf-8") as f:
+            return json.load(f)['total']
+
+    def completed_count(self):
+        return len([name for name in os.listdir(self.results_dir) if name.endswith(".json")])
+
+    def is_complete(self):
+        return os.path.exists(self.job_path) and self.completed_count() >= self.total()
+
+    def results(self):
+        """
+        :return: Результаты задач в порядке их номеров
+        """
+        results = []
+        for filename in sorted(name for name in os.listdir(self.results_dir) if name.endswith(".json")):
+            with open(os.path.join(self.results_dir, filename), "r", encoding="utf-8") as f:
+                results.append(json.load(f))
+        return results
+
+    def read_text(self, result, limit=None):
+        """
+        :return: Начало текста, извлечённого обработчиком для задачи (пустая строка, если текста нет)
+        """
+        try:
+            with open(os.path.join(self.results_dir, f"{result['id']}.txt"), "r", encoding="utf-8") as f:
+                return f.read(limit)
+        except OSError:
+            return ""
+
+    def resolve_path(self, task):
+        return os.path.normpath(os.path.join(self.queue_dir, task['path']))
+
+    @staticmethod
+    def _write_json(path, data):
+        # Запись через временный файл, чтобы читатели на других машинах не увидели половину файла
+        temp_path = f"{path}.{socket.gethostname()}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+
+
+def process_queue_task(file_path, text_path, sandbox):
+    """
+    Извлекает метаданные и текст одного файла для распределённой очереди.
+    :param file_path: Путь к файлу
+    :param text_path: Путь для сохранения извлечённого текста
+    :param sandbox: DocumentSandbox, в котором разбирается документ
+    :return: Словарь с наименованием, обозначением, количеством страниц и форматом
+    """
+    record = sandbox.call('analyze_document', file_path, ocr=True)
+    with open(text_path, "w", encoding="utf-8") as f:
+        f.write(record['text'])
+    return {
+        'name': record['name'],
+        'designation': record['designation'],
+        'pages': record['pages'],
+        'format': record['format']
+    }
+
+
+def run_queue_worker(queue_dir, poll_interval=5):
+    """
+    Обработчик распределённой очереди: захватывает задачи, выполняет извлечение и записывает результаты.
+    Запуск на любой машине с доступом к общей папке: python main.py --worker <папка очереди>
+    :param queue_dir: Папка очереди
+    :param poll_interval: Пауза между проверками очереди, секунды
+    """
+    task_queue = FileTaskQueue(queue_dir)
+    # Документы разбираются в подпроцессе: зависший файл не держит аренду задачи бесконечно
+    sandbox = DocumentSandbox()
+    worker_id = f"{socket.gethostname()}-{os.getpid()}"
+    logging.info(f"Обработчик {worker_id} подключён к очереди {queue_dir}")
+
+    while not task_queue.is_complete():
+        leased = task_queue.lease()
+        if leased is None:
+            time.sleep(poll_interval)
+            continue
+        task, lease_path = leased
+
+        # Продление аренды, пока задача выполняется
+        stop_heartbeat = threading.Event()
+
+        def heartbeat():
+            while not stop_heartbeat.wait(queue_lease_timeout / 3):
+                try:
+                    os.utime(lease_path)
+                except OSError:
+                    return
+
+        heartbeat_thread = threading.Thread(target=heartbeat, daemon=True)
+        heartbeat_thread.start()
+        try:
+            file_path = task_queue.resolve_path(task)
+            text_path = os.path.join(task_queue.results_dir, f"{task['id']}.txt")
+            result = process_queue_task(file_path, text_path, sandbox)
+            logging.info(f"Обработчик {worker_id} выполнил задачу {task['id']}: {file_path}")
+        except Exception as e:
+            # Результат с ошибкой всё равно записывается, иначе повреждённый файл будет бесконечно возвращаться в очередь
+            logging.error(f"Ошибка выполнения задачи {task['id']} обработчиком {worker_id}: {str(e)}")
+            result = {'pages': 0, 'format': os.path.splitext(task['path'])[1][1:].lower(), 'error': str(e),
+                      'quarantined': isinstance(e, DocumentQuarantined)}
+        finally:
+            stop_heartbeat.set()
+            heartbeat_thread.join()
+        result['id'] = task['id']
+        result['worker'] = worker_id
+        task_queue.complete(task, result, lease_path)
+
+    sandbox.stop()
+    logging.info(f"Обработчик {worker_id} завершил работу: все задачи выполнены")
+
+
+class StagedPipeline:
+    """
+    Потоковый конвейер: каждый этап - группа рабочих потоков, этапы соединены ограниченными очередями.
+    Элемент передаётся дальше сразу после обработки, поэтому этапы ввода-вывода и вычислений
+    работают одновременно, а если следующий этап не успевает, emit блокируется (обратное давление)
+    и в каждой очереди находится не больше queue_size элементов.
+    """
+
+    _DONE = object()
+
+    def __init__(self, stages, queue_size=None):
+        """
+        :param stages: Список кортежей (название, функция(item, emit), количество потоков)
+        :param queue_size: Ёмкость очереди перед каждым этапом (по умолчанию pipeline_queue_size)
+        """
+        self.stages = stages
+        self.queues = [queue.Queue(maxsize=queue_size or pipeline_queue_size) for _ in self.stages]
+        self.processed = [0] * len(self.stages)
+        self.results = []
+        self.errors = 0
+        self._remaining = [workers for _, _, workers in self.stages]
+        self._lock = threading.Lock()
+
+    def run(self, items):
+        """
+        Пропускает элементы через все этапы и ждёт завершения.
+        :param items: Входные элементы первого этапа
+        :return: Элементы, переданные в emit последним этапом
+        """
+        threads = []
+        for index, (name, _, workers) in enumerate(self.stages):
+            for number in range(workers):
+                thread = threading.Thread(target=self._work, args=(index,), name=f"{name}-{number + 1}", daemon=True)
+                thread.start()
+                threads.append(thread)
+        for item in items:
+            self.queues[0].put(item)
+        for _ in range(self.stages[0][2]):
+            self.queues[0].put(self._DONE)
+        for thread in threads:
+            thread.join()
+        return self.results
+
+    def progress(self):
+        return ", ".join(f"{stage[0]}: {count}" for stage, count in zip(self.stages, self.processed))
+
+    def _emit(self, index, item):
+        if index + 1 < len(self.stages):
+            self.queues[index + 1].put(item)
+        else:
+            self.results.append(item)
+
+    def _work(self, index):
+        name, func, _ = self.stages[index]
+        emit = lambda item: self._emit(index, item)
+        while True:
+            item = self.queues[index].get()
+            if item is self._DONE:
+                break
+            try:
+                func(item, emit)
+            except Exception as e:
+                with self._lock:
+                    self.errors += 1
+                logging.error(f"Ошибка на этапе конвейера '{name}': {str(e)}")
+            with self._lock:
+                self.processed[index] += 1
+
+        with self._lock:
+            self._remaining[index] -= 1
+            last = self._remaining[index] == 0
+        # Последний поток этапа закрывает очередь следующего этапа
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1][2]):
+                self.queues[index + 1].put(self._DONE)
+
+
+class DocumentPreviewPanel:
+    """
+    Окно просмотра документов перед нумерацией и переименованием: наименование, количество листов,
+    совпадение со справочником (по названию или по содержимому, как при переименовании) и миниатюра
+    первой страницы. Список виртуальный: на холсте рисуются только видимые строки, а миниатюры,
+    количество листов и совпадения по содержимому вычисляются по мере прокрутки фоновым потоком
+    в подпроцессе DocumentSandbox, чтобы разбор не мешал PyMuPDF в главном потоке.
+    """
+
+    # Хэш содержимого по (путь, размер, время изменения): при возврате к строке файл не читается заново
+    content_hashes = {}
+
+    def __init__(self, root, documents, reference_dict=None):
+        """
+        :param root: Главное окно
+        :param documents: Список записей DocumentRecord; количество листов заполняется по мере отрисовки
+        :param reference_dict: Результат load_rename_dictionary или None
+        """
+        self.documents = documents
+        self.reference_dict = reference_dict or {}
+        self.reference_key = get_reference_key(self.reference_dict)
+        self.content_matches = {}  # индекс -> название по содержимому ("" - совпадения нет)
+        self.sandbox = DocumentSandbox()
+        self.row_height = preview_thumbnail_height + 8
+        self.thumbnails = {}  # индекс -> PhotoImage, только для видимых строк
+        self.pending = set()
+        self.visible = range(0)
+        # Последние запрошенные строки отрисовываются первыми: при быстрой прокрутке важны текущие
+        self.requests = queue.LifoQueue()
+        self.results = queue.Queue()
+        self.closed = False
+
+        self.window = tk.Toplevel(root)
+        self.window.title(f"Просмотр документов ({len(documents)})")
+        self.canvas = tk.Canvas(self.window, width=760, height=self.row_height * 12, background="white")
+        scrollbar = tk.Scrollbar(self.window, orient="vertical", command=self.scroll)
+        self.canvas.configure(
+            yscrollcommand=scrollbar.set, yscrollincrement=self.row_height,
+            scrollregion=(0, 0, 760, len(documents) * self.row_height)
+        )
+        self.canvas.pack(side="left", fill="both", expand=True)
+        scrollbar.pack(side="right", fill="y")
+        self.canvas.bind("<Configure>", lambda _: self.redraw())
+        self.canvas.bind("<MouseWheel>", lambda event: self.scroll("scroll", -event.delta // 120, "units"))
+        self.canvas.bind("<Button-4>", lambda _: self.scroll("scroll", -1, "units"))
+        self.canvas.bind("<Button-5>", lambda _: self.scroll("scroll", 1, "units"))
+        self.window.protocol("WM_DELETE_WINDOW", self.close)
+
+        threading.Thread(target=self.render_worker, daemon=True).start()
+        self.window.after(50, self.poll_results)
+
+    def scroll(self, *args):
+        self.canvas.yview(*args)
+        self.redraw()
+
+    def redraw(self):
+        """Перерисовывает видимые строки и запрашивает для них недостающие миниатюры."""
+        top = int(self.canvas.canvasy(0)) // self.row_height
+        bottom = int(self.canvas.canvasy(self.canvas.winfo_height())) // self.row_height + 1
+        self.visible = range(max(top, 0), min(bottom, len(self.documents)))
+        self.thumbnails = {index: image for index, image in self.thumbnails.items() if index in self.visible}
+
+        self.canvas.delete("row")
+        for index in self.visible:
+            document = self.documents[index]
+            y = index * self.row_height
+            if index % 2:
+                self.canvas.create_rectangle(0, y, 4000, y + self.row_height, fill="#f3f3f3", width=0, tags="row")
+            image = self.thumbnails.get(index)
+            if image is not None:
+                self.canvas.create_image(4, y + 4, image=image, anchor="nw", tags="row")
+            elif index not in self.pending:
+                self.pending.add(index)
+                self.requests.put(index)
+
+            # Как в rename_file_by_reference: сначала название файла, затем содержимое
+            match = self.reference_dict.get(os.path.splitext(document.filename)[0].strip().lower())
+            if not self.reference_dict:
+                reference = "не загружен"
+            elif match:
+                reference = f"{match} (по названию)"
+            elif index not in self.content_matches:
+                reference = "проверка содержимого…"
+            elif self.content_matches[index]:
+                reference = f"{self.content_matches[index]} (по содержимому)"
+            else:
+                reference = "нет совпадения"
+            pages = "…" if document.pages is None else document.pages
+            x = preview_thumbnail_height + 12
+            self.canvas.create_text(x, y + 6, text=f"{index + 1}. {document.filename}", anchor="nw", tags="row")
+            self.canvas.create_text(
+                x, y + 26, anchor="nw", tags="row", fill="gray25",
+                text=f"Листов: {pages}    Справочник: {reference}"
+            )
+
+    def render_worker(self):
+        """Фоновый поток: данные preview_document для запрошенных строк, пока они видны."""
+        while not self.closed:
+            try:
+                index = self.requests.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            if index not in self.visible:
+                self.results.put((index, None, None, None))  # строка уже прокручена, отрисуется при возврате
+                continue
+            file_path = self.documents[index].path
+            try:
+                stat = os.stat(file_path)
+                key = (os.path.normcase(os.path.abspath(file_path)), stat.st_size, stat.st_mtime_ns)
+                content_hash = self.content_hashes.get(key)
+                preview = load_document_preview(content_hash, self.reference_key) if content_hash else None
+                if preview is None:
+                    image, pages, match, content_hash = self.sandbox.call(
+                        'preview_document', file_path, self.reference_dict
+                    )
+                    self.content_hashes[key] = content_hash
+                else:
+                    image, pages, match = preview
+            except Exception as e:
+                logging.error(f"Ошибка при создании миниатюры {file_path}: {e}")
+                image, pages, match = make_placeholder_thumbnail("?", preview_thumbnail_height), 0, None
+            self.results.put((index, image, pages, match))
+        self.sandbox.stop()
+
+    def poll_results(self):
+        """Переносит результаты фонового потока в окно (Tk доступен только из главного потока)."""
+        if self.closed:
+            return
+        changed = False
+        while True:
+            try:
+                index, image, pages, match = self.results.get_nowait()
+            except queue.Empty:
+                break
+            self.pending.discard(index)
+            if image is None:
+                changed = changed or index in self.visible  # строку успели вернуть в видимую область
+                continue
+            self.documents[index].pages = pages
+            self.content_matches[index] = match or ""
+            if index in self.visible:
+                self.thumbnails[index] = ImageTk.PhotoImage(image, master=self.window)
+                changed = True
+        if changed:
+            self.redraw()
+        self.window.after(50, self.poll_results)
+
+    def close(self):
+        self.closed = True
+        self.window.destroy()
+
+
 class DocumentProcessorApp:
     def __init__(self, root):
         self.root = root
@@ -445,6 +1816,19 @@ class DocumentProcessorApp:
         self.numbers_path = tk.StringVar()
         self.files_directory = tk.StringVar()
 
+        # Текст документов, прочитанный при анализе, для сопоставления по содержимому без повторного разбора
+        self.document_texts_lock = threading.Lock()
+        self.forget_document_texts()
+        # Проверка существования и переименование выполняются атомарно, когда файлы обрабатываются параллельно
+        self.rename_lock = threading.Lock()
+
+        # Изолированная обработка: подпроцессы для разбора документов и файлы, помещённые в карантин
+        self.sandbox_mode = tk.BooleanVar(value=False)
+        self.isolate_documents = False
+        self.sandbox_mode.trace_add("write", lambda *_: setattr(self, 'isolate_documents', self.sandbox_mode.get()))
+        self.sandboxes = queue.Queue()
+        self.quarantine = {}
+
         # Элементы интерфейса
         tk.Label(root, text="Путь к архивам:").grid(row=0, column=0, sticky="w")
         tk.Entry(root, textvariable=self.archive_paths, width=50).grid(row=0, column=1)
@@ -462,6 +1846,10 @@ class DocumentProcessorApp:
         tk.Entry(root, textvariable=self.files_directory, width=50).grid(row=2, column=1)
         tk.Button(root, text="Обзор", command=self.select_files_directory).grid(row=2, column=2)
 
+        tk.Checkbutton(
+            root, text="Изолированная обработка документов (таймаут и лимит памяти)", variable=self.sandbox_mode
+        ).grid(row=4, column=1, sticky="w")
+
         # Кнопки для функций с 3 строки и столбца
         button_commands = [
             (self.run_extraction, "Извлечь архив/архивы"),
@@ -469,13 +1857,72 @@ class DocumentProcessorApp:
             (self.run_inventory, "Сформировать опись"),
             (self.run_apply_numbers, "Нанести номера"),
             (self.run_rename_files, "Переименовать файлы"),
-            (self.run_inventory_with_reference, "Опись со справочником\n+извлечение")
+            (self.run_inventory_with_reference, "Опись со справочником\n+извлечение"),
+            (self.run_distributed_inventory, "Распределённая опись"),
+            (self.show_document_preview, "Просмотр документов")
         ]
 
+        self.buttons = []
         for index, (command, text) in enumerate(button_commands):
             row = 5 + index // 3
             column = index % 3
-            tk.Button(root, text=text, command=command).grid(row=row, column=column, padx=5, pady=5)
+            button = tk.Button(root, text=text, command=command)
+            button.grid(row=row, column=column, padx=5, pady=5)
+            self.buttons.append(button)
+
+    def show_document_preview(self):
+        """
+        Открывает окно просмотра документов директории с файлами, чтобы перед нумерацией
+        и переименованием проверить состав и совпадения со справочником без внешних программ.
+        """
+        directory = self.files_directory.get()
+        if not directory:
+            messagebox.showerror("Ошибка", "Необходимо указать директорию с файлами.")
+            return
+        reference_dict = None
+        reference_path = self.reference_path.get()
+        if reference_path.lower().endswith(".xlsx"):
+            try:
+                reference_dict = self.load_rename_dictionary(reference_path)
+            except Exception as e:
+                logging.error(f"Ошибка при загрузке справочника: {e}")
+        # Только перечисление файлов: количество листов и миниатюры вычисляются для видимых строк
+        documents = [DocumentRecord(path, None, None) for path in self.get_all_files_in_directory(directory)]
+        DocumentPreviewPanel(self.root, documents, reference_dict)
+
+    def run_in_background(self, work, on_done, progress=None):
+        """
+        Выполняет длительную операцию в фоновом потоке, не блокируя окно. Кнопки на это время
+        отключаются, чтобы повторное нажатие не запустило второй проход по тем же файлам и журналу.
+        :param work: Функция без аргументов, выполняемая в фоновом потоке
+        :param on_done: Функция (результат, исключение), вызываемая в главном потоке по завершении
+        :param progress: Функция, возвращающая строку о ходе выполнения для заголовка окна
+        """
+        for button in self.buttons:
+            button.config(state="disabled")
+        outcome = {}
+
+        def target():
+            try:
+                outcome['result'] = work()
+            except Exception as e:
+                outcome['error'] = e
+
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+
+        def poll():
+            if thread.is_alive():
+                if progress:
+                    self.root.title(f"Document Processor - {progress()}")
+                self.root.after(100, poll)
+                return
+            self.root.title("Document Processor")
+            for button in self.buttons:
+                button.config(state="normal")
+            on_done(outcome.get('result'), outcome.get('error'))
+
+        self.root.after(100, poll)
 
     def select_referenc1(self):
         file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
@@ -495,42 +1942,24 @@ class DocumentProcessorApp:
     def standardize_document_titles(self, documents, reference_dict):
         """
         Обновляет наименования документов на основе справочника.
-        :param documents: Список словарей с метаданными документов
+        :param documents: Список записей DocumentRecord (или словарей) с метаданными документов
         :param reference_dict: Справочник с наименованиями
         :return: Обновленный список документов с эталонными наименованиями
         """
+        # Шаблоны справочника компилируются один раз на весь список, а не для каждого документа
+        patterns = [
+            (re.compile(r'\b' + re.escape(partial_name) + r'\b', re.IGNORECASE), full_name)
+            for partial_name, full_name in reference_dict.items()
+        ]
         for document in documents:
             original_name = document['name']
-            for partial_name, full_name in reference_dict.items():
-                if re.search(r'\b' + re.escape(partial_name) + r'\b', original_name, re.IGNORECASE):
+            for pattern, full_name in patterns:
+                if pattern.search(original_name):
                     document['name'] = full_name
                     logging.info(f"Наименование документа обновлено с '{original_name}' на '{full_name}'")
                     break
         return documents
 
-    def extract_data_from_documents(self, directory, designation_dict):
-        """
-        Извлекает данные о документах из указанной директории.
-        :param directory: Путь к директории с документами
-        :return: Список данных о документах
-        """
-        documents = []
-        for root, _, files in os.walk(directory):
-            for filename in files:
-                file_path = os.path.join(root, filename)
-                ext = os.path.splitext(filename)[1].lower()
-                if ext in ['.pdf', '.docx', '.txt']:
-                    name, pages = self.extract_metadata(file_path, ext)
-                    name1 = os.path.splitext(name)[0]
-                    documents.append({
-                        'name': name,
-                        'designation': name1,
-                        'pages': pages,
-                        'format': ext[1:]
-                    })
-        return documents
-
-
     def extract_metadata(self, file_path, ext):
         """
         Извлекает метаданные из файла.
@@ -538,38 +1967,140 @@ class DocumentProcessorApp:
         :param ext: Расширение файла
         :return: Наименование документа и количество страниц
         """
-        name = os.path.basename(file_path)  # Имя файла
-        pages = 0  # Количество страниц, инициализируем как 0
+        record = analyze_document(file_path, with_text=False)
+        return record['name'], record['pages']
 
+    def analyze_document_once(self, file_path, analysis_cache, duplicate_index=None):
+        """
+        Анализирует файл для описи (без полного текста), разбирая каждую группу одинаковых файлов только один раз.
+        :param file_path: Путь к файлу
+        :param analysis_cache: Словарь представитель -> результат analyze_document, общий для всего прохода
+        :param duplicate_index: Соответствие дубликат -> представитель (см. build_duplicate_index)
+        :return: Результат analyze_document для этого файла или None, если файл помещён в карантин
+        """
+        key = os.path.normpath(file_path)
+        key = (duplicate_index or {}).get(key, key)
+        if key in self.quarantine:
+            # Копия документа, который уже не удалось разобрать
+            self.quarantine_file(file_path, self.quarantine[key][1])
+            return None
+        record = analysis_cache.get(key)
+        if record is None:
+            record = self.run_isolated(analyze_document, file_path, with_text=False)
+            if record is None:
+                return None
+            analysis_cache[key] = record
+        elif os.path.normpath(record['path']) != os.path.normpath(file_path):
+            name = os.path.basename(file_path)
+            record = dict(record, path=file_path, name=name,
+                          designation=detect_designation(name, record['text']))
+        return record
+
+    def run_isolated(self, func, file_path, *args, **kwargs):
+        """
+        Выполняет разбор документа; в режиме изолированной обработки - в подпроцессе DocumentSandbox
+        с ограничением времени и памяти. Из рабочих потоков (этапы конвейера) разбор всегда выполняется
+        в подпроцессах: PyMuPDF не рассчитан на параллельные потоки, а из-за GIL потоки не ускорили бы разбор.
+        :param func: Функция из SANDBOX_FUNCTIONS, первым аргументом принимающая путь к файлу
+        :param file_path: Путь к файлу
+        :return: Результат функции или None, если документ помещён в карантин
+        """
+        if not self.isolate_documents and threading.current_thread() is threading.main_thread():
+            return func(file_path, *args, **kwargs)
+        if self.is_quarantined(file_path):
+            return None
+        try:
+            sandbox = self.sandboxes.get_nowait()
+        except queue.Empty:
+            sandbox = DocumentSandbox()
         try:
-            if ext == '.pdf':
-                from PyPDF2 import PdfReader
-                with open(file_path, 'rb') as file:
-                    reader = PdfReader(file)
-                    pages = len(reader.pages)  # Получаем количество страниц в PDF
-
-            elif ext == '.docx':
-                doc = Document(file_path)
-                pages = len(doc.element.xpath('//w:sectPr'))  # Пример получения количества страниц
-
-            elif ext == '.txt':
-                with open(file_path, 'r', encoding='utf-8') as file:
-                    content = file.read()
-                    pages = content.count('\n') // 50 + 1  # Примерное количество страниц
-            elif ext == '.xlsx':
-                workbook = load_workbook(filename=file_path, read_only=True)
-                pages = len(workbook.sheetnames)
+            return sandbox.call(func.__name__, file_path, *args, **kwargs)
+        except DocumentQuarantined as e:
+            self.quarantine_file(file_path, str(e))
+            return None
+        finally:
+            self.sandboxes.put(sandbox)
+
+    def stop_sandboxes(self):
+        """
+        Завершает подпроцессы изолированной обработки по окончании операции, чтобы они
+        не занимали память до закрытия приложения.
+        """
+        while True:
+            try:
+                self.sandboxes.get_nowait().stop()
+            except queue.Empty:
+                return
 
-        except Exception as e:
-            logging.error(f"Ошибка при извлечении метаданных из файла {file_path}: {str(e)}")
+    def quarantine_file(self, file_path, reason):
+        """
+        Помещает документ в карантин: он пропускается остальными этапами и указывается в описи.
+        """
+        self.quarantine[os.path.normpath(file_path)] = (file_path, reason)
+        logging.error(f"Файл {file_path} помещён в карантин: {reason}")
+
+    def is_quarantined(self, file_path):
+        return os.path.normpath(file_path) in self.quarantine
 
-        return name, pages
+    def report_result(self, directory, message):
+        """
+        Сообщает об успешном завершении операции или, если часть файлов директории попала в карантин, предупреждает об этом.
+        """
+        quarantined = self.quarantined_in(directory)
+        if quarantined:
+            names = "\n".join(os.path.basename(file_path) for file_path, _ in quarantined[:10])
+            messagebox.showwarning("Предупреждение", f"{message}\nФайлов в карантине: {len(quarantined)}\n{names}")
+        else:
+            messagebox.showinfo("Успех", message)
+
+    def quarantined_in(self, directory):
+        """
+        :return: Список (путь, причина) для файлов карантина внутри directory
+        """
+        root = os.path.normcase(os.path.abspath(directory))
+        return [
+            (file_path, reason) for file_path, reason in self.quarantine.values()
+            if os.path.normcase(os.path.abspath(file_path)).startswith(root + os.sep)
+        ]
+
+    def remember_document_text(self, key, text):
+        """
+        Запоминает текст документа, пока общий объём не превышает document_text_cache_mb.
+        :param key: Ключ содержимого: хэш группы одинаковых файлов или нормализованный путь к файлу
+        :param text: Текст документа
+        """
+        if not text:
+            return
+        size = sys.getsizeof(text)  # объём строки в памяти: кириллица занимает 2 байта на символ
+        with self.document_texts_lock:
+            if key in self.document_texts or self.document_text_size + size > document_text_cache_mb * 1024 * 1024:
+                return
+            self.document_texts[key] = text
+            self.document_text_size += size
 
-    def create_inventory(self, documents, output_path):
+    def take_document_text(self, key):
+        """
+        Забирает запомненный текст документа из кэша.
+        :return: Текст или None, если он не сохранялся
+        """
+        with self.document_texts_lock:
+            text = self.document_texts.pop(key, None)
+            if text is not None:
+                self.document_text_size -= sys.getsizeof(text)
+            return text
+
+    def forget_document_texts(self):
+        with self.document_texts_lock:
+            self.document_texts = {}
+            self.document_text_size = 0
+
+    def create_inventory(self, documents, output_path, duplicate_groups=None, quarantined=None):
         """
         Создает опись документов и сохраняет в формате .docx.
         :param documents: Данные о документах
         :param output_path: Путь для сохранения
+        :param duplicate_groups: Группы одинаковых файлов для отчёта в конце описи
+        :param quarantined: Список (путь, причина) для файлов, которые не удалось обработать
         """
         try:
             doc = Document()
@@ -580,141 +2111,440 @@ class DocumentProcessorApp:
                     f"Количество листов: {document['pages']}\n"
                     f"Формат: {document['format']}"
                 )
+            if duplicate_groups:
+                doc.add_paragraph("Одинаковые файлы:")
+                for index, group in enumerate(duplicate_groups, start=1):
+                    doc.add_paragraph(f"Группа {index}:\n" + "\n".join(group))
+            if quarantined:
+                doc.add_paragraph("Файлы в карантине (не обработаны):")
+                for file_path, reason in quarantined:
+                    doc.add_paragraph(f"{file_path}: {reason}")
             doc.save(output_path)
             logging.info(f"Опись сохранена: {output_path}")
         except Exception as e:
             logging.error(f"Ошибка при создании описи: {e}")
 
     def run_inventory_with_reference(self):
+        """
+        Опись со справочником: извлечение архивов, нанесение номеров, анализ документов,
+        приведение наименований и переименование по справочнику, затем опись.
+        Этапы выполняются конвейером StagedPipeline: файл переходит к следующему этапу сразу
+        после обработки, поэтому чтение архивов и диска идёт одновременно с разбором документов.
+        Разбор документов выполняется в подпроцессах (см. run_isolated), количество потоков
+        и подпроцессов этапов - pipeline_stage_workers.
+        """
         reference_path = self.reference_path.get()
         files_directory = self.files_directory.get()
         output_directory = self.output_directory.get()
-        designation_file_path = self.reference_path.get()
-        archive_paths = self.archive_paths.get()
+        archive_paths = [path for path in self.archive_paths.get().split(";") if path]
 
-
-        if not reference_path or not files_directory or not output_directory or not designation_file_path:
+        if not reference_path or not files_directory or not output_directory:
             messagebox.showerror("Ошибка", "Необходимо указать все пути.")
             return
 
-        # Извлечение архивов
-        self.run_extraction()
-        # Нанесение номеров на файлы
-        self.run_apply_numbers()
-
-        # Загрузка справочника и обозначений
         reference_dict = self.load_reference_from_excel(reference_path)
-        designation_dict = self.load_reference_from_excel(reference_path)
-
-        # Извлечение данных о документах
-        documents = self.extract_data_from_documents(files_directory,designation_dict)
+        try:
+            rename_dict = self.load_rename_dictionary(reference_path) or {}
+        except Exception as e:
+            logging.error(f"Ошибка при загрузке справочника для переименования: {str(e)}")
+            rename_dict = {}
+
+        # Журнал позволяет продолжить прерванный запуск, не повторяя выполненные шаги
+        journal = RunJournal(files_directory, "inventory_with_reference")
+        files_root = os.path.abspath(files_directory)
+        emitted = set()
+        state_lock = threading.Lock()
+        analysis_by_hash = {}
+        files_by_hash = {}
+        content_matches = {}
+        group_locks = {}
+        # Номера наносятся только на документы, попадающие в опись, поэтому номера в описи идут подряд.
+        # Остальные файлы (.xlsx и т. п.) не нумеруются. Документ, попавший в карантин после назначения номеров,
+        # сохраняет свой номер: пропуск в описи соответствует файлу из раздела карантина
+        inventory_formats = ('.pdf', '.docx', '.txt')
+
+        def group_lock(item):
+            # Одинаковые файлы обрабатываются по очереди: копии ждут разбора первого из них
+            group = item['hash'] or os.path.normpath(item['path'])
+            with state_lock:
+                return group, group_locks.setdefault(group, threading.Lock())
+
+        def emit_file(file_path, emit):
+            key = os.path.normpath(os.path.abspath(file_path))
+            with state_lock:
+                if key in emitted:
+                    return
+                emitted.add(key)
+            emit({'path': file_path, 'source_path': file_path})
+
+        def extraction_stage(source, emit):
+            kind, archive_path = source
+            if kind == 'file':
+                emit_file(archive_path, emit)
+                return
+            if not os.path.isfile(archive_path):
+                logging.error(f"Указанный архив не существует: {archive_path}")
+                return
+            if not journal.is_done('extracted', archive_path):
+                if not extract_archive(archive_path, output_directory, interactive=False):
+                    return
+                journal.mark('extracted', archive_path)
+            # Файлы архива, попавшие в директорию с файлами, сразу уходят на следующий этап
+            for member in list_archive_members(archive_path):
+                file_path = os.path.abspath(os.path.join(output_directory, member))
+                try:
+                    inside = os.path.commonpath([file_path, files_root]) == files_root
+                except ValueError:
+                    inside = False  # разные диски
+                if inside and os.path.isfile(file_path):
+                    emit_file(file_path, emit)
+
+        def numbering_stage(item, emit):
+            file_path = item['path']
+            # Хэш содержимого запоминается до нанесения номера, пока копии ещё побайтно совпадают
+            content_hash = journal.get('hashed', file_path)
+            if content_hash is None and file_path.lower().endswith(('.pdf', '.docx', '.txt', '.xlsx')):
+                content_hash = hash_file(file_path)
+            number = None
+            if file_path.lower().endswith(inventory_formats):
+                number = assigned_numbers.get(os.path.normpath(os.path.abspath(file_path)))
+                if number is None:
+                    with state_lock:
+                        number = next(extra_numbers)  # файл, которого не было в архиве при перечислении
+                if not journal.is_done('numbered', file_path) and not self.is_quarantined(file_path):
+                    if self.run_isolated(apply_number_to_file, file_path, number, file_path, interactive=False):
+                        journal.mark('numbered', file_path, number)
+            item['number'] = number
+            if content_hash is not None:
+                journal.mark('hashed', file_path, content_hash)
+                with state_lock:
+                    files_by_hash.setdefault(content_hash, []).append(file_path)
+            item['hash'] = content_hash
+            emit(item)
+
+        def analysis_stage(item, emit):
+            file_path = item['path']
+            ext = os.path.splitext(file_path)[1].lower()
+            if ext in inventory_formats and not self.is_quarantined(file_path):
+                metadata = journal.get('inventoried', file_path)
+                if metadata is None:
+                    # Одинаковые файлы анализируются один раз
+                    group, lock = group_lock(item)
+                    with lock:
+                        cached = analysis_by_hash.get(group)
+                        if cached is None:
+                            record = self.run_isolated(analyze_document, file_path)
+                            if record is None:
+                                emit(item)  # файл в карантине
+                                return
+                            if rename_dict:
+                                # Текст группы для сопоставления по содержимому на следующем этапе
+                                self.remember_document_text(group, record['text'])
+                            cached = analysis_by_hash[group] = {
+                                'pages': record['pages'], 'text': record['text'][:designation_search_chars]
+                            }
+                    name = os.path.basename(file_path)
+                    metadata = {'pages': cached['pages'], 'designation': detect_designation(name, cached['text'])}
+                    journal.mark('inventoried', file_path, metadata)
+                item['document'] = DocumentRecord(
+                    item['source_path'], metadata['designation'], metadata['pages'], ext[1:]
+                )
+            emit(item)
+
+        def matching_stage(item, emit):
+            if 'document' in item:
+                self.standardize_document_titles([item['document']], reference_dict)
+            if rename_dict:
+                # Совпадения по содержимому ищутся один раз на группу одинаковых файлов
+                group, lock = group_lock(item)
+                with lock:
+                    item['path'] = self.rename_file_by_reference(
+                        item['path'], rename_dict, group, content_matches, journal
+                    )
+            emit(item)
+
+        pipeline = StagedPipeline([
+            ("извлечение", extraction_stage, pipeline_stage_workers['extraction']),
+            ("нумерация", numbering_stage, pipeline_stage_workers['numbering']),
+            ("анализ", analysis_stage, pipeline_stage_workers['analysis']),
+            ("справочник", matching_stage, pipeline_stage_workers['matching']),
+        ])
+        # Файлы директории перечисляются до запуска: во время работы конвейера они переименовываются,
+        # и повторный обход увидел бы их под новыми именами. Архивы идут следом
+        sources = [
+            ('file', os.path.join(root, filename))
+            for root, _, files in walk_sorted(files_root)
+            for filename in files
+        ]
+        sources.extend(('archive', archive_path) for archive_path in archive_paths)
+
+        # Номера назначаются заранее в порядке описи: потоки заканчивают обработку файлов в разном порядке,
+        # а номер на файле должен совпадать с его номером в описи. Файлы архивов известны по их оглавлению.
+        # Файлы, пронумерованные в прерванном запуске, сохраняют свои номера
+        file_keys = {
+            os.path.normpath(os.path.abspath(path)) for kind, path in sources
+            if kind == 'file' and path.lower().endswith(inventory_formats)
+        }
+        for archive_path in archive_paths:
+            try:
+                members = list_archive_members(archive_path) if os.path.isfile(archive_path) else []
+            except Exception as e:
+                logging.error(f"Не удалось прочитать оглавление архива {archive_path}: {str(e)}")
+                members = []
+            for member in members:
+                file_path = os.path.abspath(os.path.join(output_directory, member))
+                if not file_path.lower().endswith(inventory_formats):
+                    continue
+                try:
+                    if os.path.commonpath([file_path, files_root]) == files_root:
+                        file_keys.add(os.path.normpath(file_path))
+                except ValueError:
+                    pass  # разные диски
+        used_numbers = set(journal.values('numbered'))
+        free_numbers = (number for number in itertools.count(1) if number not in used_numbers)
+        assigned_numbers = {}
+        for key in sorted(file_keys, key=DocumentRecord.path_sort_key):
+            number = journal.get('numbered', key)
+            assigned_numbers[key] = number if number is not None else next(free_numbers)
+        extra_numbers = itertools.count(max(itertools.chain(assigned_numbers.values(), used_numbers), default=0) + 1)
+
+        def finish(results, error):
+            self.forget_document_texts()
+            self.stop_sandboxes()
+            if error is not None:
+                journal.close()
+                logging.error(f"Ошибка при создании описи со справочником: {str(error)}")
+                messagebox.showerror("Ошибка", f"Ошибка при создании описи: {str(error)}")
+                return
 
-        # Приведение наименований документов
-        standardized_documents = self.standardize_document_titles(documents, reference_dict)
-        #self.rename_files_according_to_reference(documents, reference_dict)
-        # Нанесение номеров на документы
-        self.rename_files_recursively(files_directory,reference_path)
-        self.add_numbers_to_document_titles(standardized_documents)
+            # Опись в порядке исходных путей файлов (как при walk_sorted),
+            # независимо от порядка завершения обработки; у каждого документа номер, нанесённый на файл
+            documents = []
+            for item in results:
+                if 'document' in item:
+                    item['document'].number = item['number']
+                    documents.append(item['document'])
+            documents.sort(key=DocumentRecord.sort_key)
+            duplicate_groups = [sorted(paths) for paths in files_by_hash.values() if len(paths) > 1]
+
+            output_path = os.path.join(output_directory, "опись.docx")
+            self.create_inventory(documents, output_path, duplicate_groups, self.quarantined_in(files_directory))
+            journal.finish()
+            if pipeline.errors:
+                messagebox.showwarning("Предупреждение", f"Опись создана, ошибок при обработке файлов: {pipeline.errors}.")
+            else:
+                self.report_result(
+                    files_directory, "Опись успешно создана с учетом справочника, обозначений и нанесенных номеров."
+                )
 
-        # Создание и сохранение описи
-        output_path = os.path.join(output_directory, "опись.docx")
-        self.create_inventory(standardized_documents, output_path)
-        messagebox.showinfo("Успех", "Опись успешно создана с учетом справочника, обозначений и нанесенных номеров.")
+        self.run_in_background(lambda: pipeline.run(sources), finish, pipeline.progress)
 
-    def rename_files_recursively(self, directory, reference_path):
+    def run_distributed_inventory(self):
         """
-        Рекурсивно переименовывает файлы в каталоге, сравнивая их содержимое и название со справочником.
-        :param directory: Путь к директории с файлами
-        :param reference_path: Путь к Excel файлу справочника
+        Координатор распределённой описи: делит работу на задачи по файлам в общей папке очереди,
+        ждёт их выполнения обработчиками и собирает опись в порядке walk_sorted, как остальные описи.
         """
-        try:
-            # Загружаем справочник
-            df_reference = pd.read_excel(reference_path)
-            logging.debug(f"Загружены данные справочника:\n{df_reference.head()}")
+        files_directory = self.files_directory.get()
+        output_directory = self.output_directory.get()
+        if not files_directory or not output_directory:
+            messagebox.showerror("Ошибка", "Необходимо указать директорию с файлами и директорию для результатов.")
+            return
 
-            # Проверка структуры справочника
-            if 'Русское название' not in df_reference.columns or 'Английское название' not in df_reference.columns:
-                logging.error("Справочник должен содержать столбцы 'Русское название' и 'Английское название'.")
+        # Порядок файлов как при обычной описи; одинаковые файлы отправляются в работу один раз
+        file_paths = [
+            os.path.join(root, filename)
+            for root, _, files in walk_sorted(files_directory)
+            for filename in files
+            if os.path.splitext(filename)[1].lower() in ['.pdf', '.docx', '.txt']
+        ]
+        duplicate_groups = find_duplicate_files(file_paths)
+        duplicate_index = build_duplicate_index(duplicate_groups)
+        task_paths = [path for path in file_paths if os.path.normpath(path) not in duplicate_index]
+
+        queue_dir = os.path.join(output_directory, "queue")
+        task_queue = FileTaskQueue(queue_dir)
+        task_queue.create_job(task_paths)
+        messagebox.showinfo(
+            "Очередь создана",
+            f"Задач: {len(task_paths)}. Запустите обработчики на машинах с доступом к папке:\n"
+            f"python main.py --worker \"{queue_dir}\""
+        )
+
+        status = {'completed': 0}
+
+        def wait_for_workers():
+            while not task_queue.is_complete():
+                task_queue.requeue_expired(queue_lease_timeout)
+                status['completed'] = task_queue.completed_count()
+                time.sleep(1)
+
+        def finish(_, error):
+            if error is not None:
+                logging.error(f"Ошибка при ожидании распределённой очереди: {str(error)}")
+                messagebox.showerror("Ошибка", f"Ошибка распределённой описи: {str(error)}")
                 return
+            self.finish_distributed_inventory(
+                task_queue, file_paths, task_paths, duplicate_groups, duplicate_index, output_directory
+            )
 
-            # Создание словаря для переименования (включаем и русские, и английские названия)
-            reference_dict = {
-                str(row['Русское название']).strip().lower(): str(row['Русское название']).strip()
-                for _, row in df_reference.iterrows()
-            }
-            reference_dict.update({
-                str(row['Английское название']).strip().lower(): str(row['Русское название']).strip()
-                for _, row in df_reference.iterrows()
-            })
-            logging.debug(f"Словарь для переименования: {reference_dict}")
-
-            # Проход по всем файлам в директории рекурсивно
-            for root, _, files in os.walk(directory):
-                logging.debug(f"Проверяем директорию: {root}")
-
-                for filename in files:
-                    file_path = os.path.join(root, filename)
-                    name_without_ext, ext = os.path.splitext(filename)
-                    name_lower = name_without_ext.lower()
-
-                    logging.debug(f"Обрабатываем файл: {filename}")
-
-                    # Проверка прав доступа
-                    if not os.access(file_path, os.R_OK | os.W_OK):
-                        logging.warning(f"Нет доступа к файлу: {file_path}")
-                        continue
-
-                    # Проверка совпадения по названию файла
-                    new_name = reference_dict.get(name_lower)
-                    if new_name:
-                        new_filename = f"{new_name}{ext}"
-                        new_file_path = os.path.join(root, new_filename)
-
-                        # Переименовываем файл, если имя изменилось и файла с таким именем ещё нет
-                        if new_file_path != file_path and not os.path.exists(new_file_path):
-                            try:
-                                os.rename(file_path, new_file_path)
-                                logging.info(f"Файл '{filename}' переименован в '{new_filename}' по названию")
-                            except Exception as e:
-                                logging.error(f"Ошибка при переименовании файла '{filename}': {str(e)}")
-                            continue
+        self.run_in_background(
+            wait_for_workers, finish, lambda: f"выполнено {status['completed']} из {len(task_paths)}"
+        )
 
-                    # Если совпадение по названию не найдено, проверяем содержимое файла
-                    file_content = read_file_content(file_path, ext)
-                    if not file_content:
-                        logging.debug(f"Не удалось прочитать содержимое файла: {filename}")
-                        continue
+    def finish_distributed_inventory(self, task_queue, file_paths, task_paths, duplicate_groups, duplicate_index,
+                                     output_directory):
+        """
+        Собирает распределённую опись из результатов обработчиков в порядке file_paths.
+        """
+        results_by_path = {
+            os.path.normpath(task_paths[int(result['id'])]): result for result in task_queue.results()
+        }
+        documents = []
+        quarantined = []
+        for file_path in file_paths:
+            key = os.path.normpath(file_path)
+            result = results_by_path[duplicate_index.get(key, key)]
+            if result.get('quarantined'):
+                quarantined.append((file_path, result['error']))
+                continue
+            name = os.path.basename(file_path)
+            designation = result.get('designation')
+            if key in duplicate_index or designation is None:
+                # У копии своё имя: обозначение ищется в нём, затем в начале текста представителя
+                designation = detect_designation(name, task_queue.read_text(result, designation_search_chars))
+            documents.append(DocumentRecord(file_path, designation, result['pages'], result['format']))
 
-                    # Проверка совпадения по содержимому файла
-                    for ref_name, new_name in reference_dict.items():
-                        if re.search(rf"\b{re.escape(ref_name)}\b", file_content, re.IGNORECASE):
-                            new_filename = f"{new_name}{ext}"
-                            new_file_path = os.path.join(root, new_filename)
-
-                            # Переименовываем файл по содержимому
-                            if new_file_path != file_path and not os.path.exists(new_file_path):
-                                try:
-                                    os.rename(file_path, new_file_path)
-                                    logging.info(f"Файл '{filename}' переименован в '{new_filename}' по содержимому")
-                                    break
-                                except Exception as e:
-                                    logging.error(f"Ошибка при переименовании файла '{filename}': {str(e)}")
-                            else:
-                                logging.warning(f"Файл с именем '{new_filename}' уже существует.")
-            logging.info("Рекурсивное переименование файлов завершено.")
-        except Exception as e:
-            logging.error(f"Ошибка при загрузке справочника или переименовании файлов: {str(e)}")
+        output_path = os.path.join(output_directory, "опись.docx")
+        self.create_inventory(documents, output_path, duplicate_groups, quarantined)
+        if quarantined:
+            messagebox.showwarning(
+                "Предупреждение", f"Распределённая опись создана, файлов в карантине: {len(quarantined)}."
+            )
+        else:
+            messagebox.showinfo("Успех", "Распределённая опись успешно создана.")
 
-    def add_numbers_to_document_titles(self, documents):
+    def load_rename_dictionary(self, reference_path):
         """
-        Добавляет номера к наименованиям документов.
-        :param documents: Список документов с метаданными
-        :return: Обновленный список документов с добавленными номерами
+        Загружает справочник для переименования файлов.
+        :param reference_path: Путь к Excel файлу справочника
+        :return: Словарь название в нижнем регистре -> русское название или None, если структура неверна
         """
-        for index, document in enumerate(documents, start=1):
-            document['name'] = f"{index}. {document['name']}"  # Добавляем номер перед названием
-            logging.info(f"Номер добавлен к документу: {document['name']}")
-        return documents
+        # Загружаем справочник
+        df_reference = pd.read_excel(reference_path)
+        logging.debug(f"Загружены данные справочника:\n{df_reference.head()}")
+
+        # Проверка структуры справочника
+        if 'Русское название' not in df_reference.columns or 'Английское название' not in df_reference.columns:
+            logging.error("Справочник должен содержать столбцы 'Русское название' и 'Английское название'.")
+            return None
+
+        # Создание словаря для переименования (включаем и русские, и английские названия)
+        reference_dict = {
+            str(row['Русское название']).strip().lower(): str(row['Русское название']).strip()
+            for _, row in df_reference.iterrows()
+        }
+        reference_dict.update({
+            str(row['Английское название']).strip().lower(): str(row['Русское название']).strip()
+            for _, row in df_reference.iterrows()
+        })
+        logging.debug(f"Словарь для переименования: {reference_dict}")
+        return reference_dict
+
+    def rename_file_by_reference(self, file_path, reference_dict, content_key=None, content_matches=None,
+                                 journal=None):
+        """
+        Переименовывает один файл по справочнику: сначала по названию, затем по содержимому.
+        :param file_path: Путь к файлу
+        :param reference_dict: Результат load_rename_dictionary
+        :param content_key: Ключ содержимого (хэш группы одинаковых файлов); по нему берётся текст,
+                            запомненный при анализе, и совпадения из content_matches
+        :param content_matches: Общий для прохода кэш ключ содержимого -> совпадения по содержимому,
+                                чтобы группа одинаковых файлов читалась один раз
+        :param journal: Журнал запуска; уже проверенные файлы пропускаются
+        :return: Путь к файлу после проверки
+        """
+        root, filename = os.path.split(file_path)
+        name_without_ext, ext = os.path.splitext(filename)
+        name_lower = name_without_ext.lower()
+
+        logging.debug(f"Обрабатываем файл: {filename}")
+
+        # Проверка прав доступа
+        if not os.access(file_path, os.R_OK | os.W_OK):
+            logging.warning(f"Нет доступа к файлу: {file_path}")
+            return file_path
+
+        # Файл уже проверен в прерванном запуске или не поддаётся разбору
+        if (journal and journal.is_done('renamed', file_path)) or self.is_quarantined(file_path):
+            return file_path
+        final_path = file_path
+
+        # Проверка совпадения по названию файла
+        new_name = reference_dict.get(name_lower)
+        if new_name:
+            new_filename = f"{new_name}{ext}"
+            new_file_path = os.path.join(root, new_filename)
+
+            # Переименовываем файл, если имя изменилось и файла с таким именем ещё нет
+            with self.rename_lock:
+                if new_file_path != file_path and not os.path.exists(new_file_path):
+                    try:
+                        os.rename(file_path, new_file_path)
+                        final_path = new_file_path
+                        logging.info(f"Файл '{filename}' переименован в '{new_filename}' по названию")
+                    except Exception as e:
+                        logging.error(f"Ошибка при переименовании файла '{filename}': {str(e)}")
+                    self.mark_renamed(journal, file_path, final_path)
+                    return final_path
+
+        # Если совпадение по названию не найдено, проверяем содержимое файла
+        key = content_key or os.path.normpath(file_path)
+        matches = content_matches.get(key) if content_matches is not None else None
+        if matches is None:
+            # Текст, уже прочитанный при анализе документа, повторно не разбирается
+            file_content = self.take_document_text(key)
+            if file_content is None:
+                file_content = self.run_isolated(read_file_content, file_path, ext)
+            if not file_content:
+                logging.debug(f"Не удалось прочитать содержимое файла: {filename}")
+
+            # Проверка совпадения по содержимому файла; для группы одинаковых файлов
+            # совпадения вычисляются один раз и переиспользуются
+            matches = list(find_reference_matches(file_content, reference_dict)) if file_content else []
+            if content_matches is not None:
+                content_matches[key] = matches
+
+        for new_name in matches:
+            new_filename = f"{new_name}{ext}"
+            new_file_path = os.path.join(root, new_filename)
+
+            # Переименовываем файл по содержимому
+            with self.rename_lock:
+                if new_file_path != file_path and not os.path.exists(new_file_path):
+                    try:
+                        os.rename(file_path, new_file_path)
+                        final_path = new_file_path
+                        logging.info(f"Файл '{filename}' переименован в '{new_filename}' по содержимому")
+                        break
+                    except Exception as e:
+                        logging.error(f"Ошибка при переименовании файла '{filename}': {str(e)}")
+                else:
+                    logging.warning(f"Файл с именем '{new_filename}' уже существует.")
+        self.mark_renamed(journal, file_path, final_path)
+        return final_path
+
+    def mark_renamed(self, journal, file_path, final_path):
+        """
+        Отмечает в журнале, что файл проверен по справочнику, перенося его шаги на новое имя.
+        :param journal: Журнал запуска или None
+        :param file_path: Путь к файлу до проверки
+        :param final_path: Путь к файлу после проверки (совпадает с file_path, если файл не переименован)
+        """
+        if not journal:
+            return
+        if final_path != file_path:
+            journal.rename(file_path, final_path)
+        journal.mark('renamed', final_path)
 
     def select_archives(self):
             file_paths = filedialog.askopenfilenames(filetypes=[("Archive files", "*.zip *.rar *.7z")])
@@ -791,49 +2621,99 @@ class DocumentProcessorApp:
             logging.error("Директория для извлечения не указана.")
             return
 
-        # Запрос пути для сохранения извлечённого текста и изображений
-        output_directory = filedialog.askdirectory(title="Выберите директорию для сохранения извлечённых данных")
-        if not output_directory:
-            logging.error("Директория для сохранения не указана.")
-            return
-
-        extracted_data = ""
-        output_image_dir = os.path.join(output_directory, "extracted_images")  # Директория для сохранения изображений
-        os.makedirs(output_image_dir, exist_ok=True)  # Создаём директорию, если она не существует
-
-        # Путь для сохранения извлечённого текста
-        output_text_path = os.path.join(output_directory, "extracted_data.txt")
-
-        # Используем os.walk для рекурсивного обхода всех подкаталогов
-        for root, _, files in os.walk(directory):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                _, ext = os.path.splitext(file_name)
+        journal = RunJournal(directory, "extract_text_and_images")
+        # При продолжении прерванного запуска данные дописываются в ту же директорию
+        output_directory = journal.get('output_directory', directory)
+        if output_directory is None:
+            # Запрос пути для сохранения извлечённого текста и изображений
+            output_directory = filedialog.askdirectory(title="Выберите директорию для сохранения извлечённых данных")
+            if not output_directory:
+                logging.error("Директория для сохранения не указана.")
+                journal.close()
+                return
+            journal.mark('output_directory', directory, output_directory)
 
-                if ext.lower() == ".xlsx":
-                    extracted_data += f"\n--- Данные из {file_name} ---\n"
-                    extracted_data += extract_data_from_xlsx(file_path)  # Прямо добавляем данные
+        try:
+            output_image_dir = os.path.join(output_directory, "extracted_images")  # Директория для сохранения изображений
+            os.makedirs(output_image_dir, exist_ok=True)  # Создаём директорию, если она не существует
+
+            # Путь для сохранения извлечённого текста
+            output_text_path = os.path.join(output_directory, "extracted_data.txt")
+
+            # Одинаковые файлы извлекаются один раз, для копий указывается ссылка на уже извлечённый файл
+            duplicate_index = build_duplicate_index(find_duplicate_files(self.get_all_files_in_directory(directory)))
+            extracted_files = {}
+
+            # Текст пишется в файл по мере извлечения, а не накапливается в памяти.
+            # При продолжении отбрасывается текст файла, извлечение которого было прервано
+            resume_offset = max(journal.values('extracted'), default=0)
+            with open(output_text_path, "a" if journal.resumed else "w", encoding="utf-8") as output_file:
+                output_file.truncate(resume_offset)
+                # Рекурсивный обход всех подкаталогов в порядке описи
+                for root, _, files in walk_sorted(directory):
+                    for file_name in files:
+                        file_path = os.path.join(root, file_name)
+                        _, ext = os.path.splitext(file_name)
+
+                        key = os.path.normpath(file_path)
+                        key = duplicate_index.get(key, key)
+                        if journal.is_done('extracted', file_path):
+                            extracted_files.setdefault(key, file_path)
+                            continue
+                        if key in extracted_files:
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            output_file.write(f"(совпадает с {extracted_files[key]})\n")
+                            logging.info(f"Файл {file_path} совпадает с {extracted_files[key]}, извлечение пропущено")
+                            output_file.flush()
+                            journal.mark('extracted', file_path, output_file.tell())
+                            continue
+                        extracted_files[key] = file_path
 
-                elif ext.lower() == ".docx":
-                    extracted_data += f"\n--- Данные из {file_name} ---\n"
-                    extracted_data += extract_data_from_docx(file_path,
-                                                             output_image_dir)  # Передаём путь для сохранения изображений
+                        if ext.lower() == ".xlsx":
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            output_file.write(self.run_isolated(extract_data_from_xlsx, file_path) or "")  # Прямо добавляем данные
 
-                elif ext.lower() == ".txt":
-                    extracted_data += f"\n--- Данные из {file_name} ---\n"
-                    extracted_data += extract_data_from_txt(file_path)  # Измените, если нужно передать путь
+                        elif ext.lower() == ".docx":
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            output_file.write(self.run_isolated(extract_data_from_docx, file_path,
+                                                                output_image_dir) or "")  # Передаём путь для сохранения изображений
 
-                elif ext.lower() == ".pdf":
-                    extracted_data += f"\n--- Данные из {file_name} ---\n"
-                    extracted_data += extract_data_from_pdf(file_path,
-                                                            output_image_dir)  # Передаём путь для сохранения изображений
+                        elif ext.lower() == ".txt":
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            # Текст декодируется и записывается блоками, без загрузки файла целиком
+                            try:
+                                for chunk in iter_txt_chunks(file_path):
+                                    output_file.write(chunk)
+                                logging.info(f"Текст успешно извлечён из {file_path}")
+                            except Exception as e:
+                                logging.error(f"Ошибка при извлечении текста из {file_path}: {str(e)}")
 
-        # Сохранение извлечённых данных в текстовый файл
-        with open(output_text_path, "w", encoding="utf-8") as output_file:
-            output_file.write(extracted_data)
+                        elif ext.lower() == ".pdf" and self.isolate_documents:
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            # В подпроцессе PDF извлекается целиком: страницы не передаются по одной
+                            output_file.write(self.run_isolated(extract_data_from_pdf, file_path, output_image_dir) or "")
 
+                        elif ext.lower() == ".pdf":
+                            output_file.write(f"\n--- Данные из {file_name} ---\n")
+                            # PDF пишется постранично: в памяти держится только текущая страница
+                            try:
+                                for page_text in iter_pdf_pages_data(file_path, output_image_dir):
+                                    output_file.write(page_text)
+                                logging.info(f"Текст успешно извлечён из {file_path}")
+                            except Exception as e:
+                                logging.error(f"Ошибка при извлечении текста из {file_path}: {str(e)}")
+
+                        # Контрольная точка: текст файла записан на диск
+                        output_file.flush()
+                        journal.mark('extracted', file_path, output_file.tell())
+        except Exception:
+            journal.close()
+            raise
+        finally:
+            self.stop_sandboxes()
+        journal.finish()
         logging.info("Извлечение текста и изображений завершено.")
-        messagebox.showinfo("Успех", "Извлечение завершено.")
+        self.report_result(directory, "Извлечение завершено.")
 
     def get_all_files_in_directory(self,directory, extensions=('.pdf', '.docx', '.txt', '.xlsx')):
         """
@@ -843,7 +2723,7 @@ class DocumentProcessorApp:
         :return: Список путей к файлам с нужными расширениями
         """
         file_paths = []
-        for root, _, files in os.walk(directory):
+        for root, _, files in walk_sorted(directory):
             for filename in files:
                 if filename.lower().endswith(extensions):
                     file_paths.append(os.path.join(root, filename))
@@ -864,27 +2744,29 @@ class DocumentProcessorApp:
 
         # Получаем все файлы с нужными расширениями во всех подкаталогах
         all_files = self.get_all_files_in_directory(directory)
+        duplicate_groups = find_duplicate_files(all_files)
+        duplicate_index = build_duplicate_index(duplicate_groups)
+        analysis_cache = {}
 
         # Проходим по каждому файлу и извлекаем данные
         for file_path in all_files:
             ext = os.path.splitext(file_path)[1].lower()
-            name, pages = self.extract_metadata(file_path, ext)
-            name1 = os.path.splitext(name)[0]  # Убираем расширение из имени файла
-            extracted_data.append({
-                'name': name,
-                'designation': name1,
-                'pages': pages,
-                'format': ext[1:]
-            })
+            record = self.analyze_document_once(file_path, analysis_cache, duplicate_index)
+            if record is None:
+                continue  # файл в карантине
+            extracted_data.append(DocumentRecord(file_path, record['designation'], record['pages'], ext[1:]))
+        self.stop_sandboxes()
 
         # Проверяем наличие извлечённых данных перед созданием описи
         if extracted_data:
             # Создаем опись документов
             output_path = os.path.join(directory, "опись.docx")
             try:
-                self.create_inventory(extracted_data, output_path)  # Создаем опись
+                self.create_inventory(
+                    extracted_data, output_path, duplicate_groups, self.quarantined_in(directory)
+                )  # Создаем опись
                 logging.info("Опись документов успешно создана.")
-                messagebox.showinfo("Успех", "Опись документов успешно создана.")
+                self.report_result(directory, "Опись документов успешно создана.")
             except Exception as e:
                 logging.error(f"Ошибка при создании описи документов: {e}")
                 messagebox.showerror("Ошибка", "Ошибка при создании описи документов.")
@@ -895,16 +2777,34 @@ class DocumentProcessorApp:
     def run_apply_numbers(self):
         """Метод для автоматического нанесения номеров на файлы во всех подкаталогах."""
         directory = self.files_directory.get()
+        journal = RunJournal(directory, "apply_numbers")
 
         # Пронумеровываем и переименовываем файлы рекурсивно
         index = 1
-        for root, _, files in os.walk(directory):
-            for file_name in files:
-                file_path = os.path.join(root, file_name)
-                output_path = os.path.join(root, file_name)  # Сохраняем в той же папке
-                # Нанесение текущего номера на файл и сохранение под новым именем
-                apply_number_to_file(file_path, index, output_path)
-                index += 1
+        try:
+            for root, _, files in walk_sorted(directory):
+                for file_name in files:
+                    file_path = os.path.join(root, file_name)
+                    output_path = os.path.join(root, file_name)  # Сохраняем в той же папке
+                    # Файл уже пронумерован в прерванном запуске: второй номер не наносится,
+                    # а нумерация продолжается после сохранённого номера
+                    number = journal.get('numbered', file_path)
+                    if number is not None:
+                        index = number + 1
+                        continue
+                    if self.is_quarantined(file_path):
+                        continue
+                    # Нанесение текущего номера на файл и сохранение под новым именем
+                    if self.run_isolated(apply_number_to_file, file_path, index, output_path,
+                                         interactive=not self.isolate_documents):
+                        journal.mark('numbered', file_path, index)
+                    index += 1
+        except Exception:
+            journal.close()
+            raise
+        finally:
+            self.stop_sandboxes()
+        journal.finish()
 
         messagebox.showinfo("Успех", "Номера успешно нанесены на файлы во всех каталогах и подкаталогах.")
 
@@ -914,6 +2814,10 @@ def run_rename_files(self):
 
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # подпроцессы изолированной обработки в сборке PyInstaller
+    if len(sys.argv) > 2 and sys.argv[1] == "--worker":
+        run_queue_worker(sys.argv[2])
+        sys.exit()
     root = tk.Tk()
     app = DocumentProcessorApp(root)
     root.mainloop()
\ No newline at end of file